@@ -0,0 +1,2 @@
+-- targets: translate, convert
+DELETE FROM order_lines WHERE order_id IN (SELECT id FROM orders WHERE status = 'cancelled' AND created < dateadd(day, -30, getdate()))
@@ -0,0 +1,2 @@
+-- targets: translate, convert
+INSERT INTO orders (id, customer_id, amount, status, created) VALUES (1001, 42, 19.99, 'paid', '2024-01-01 10:00:00')
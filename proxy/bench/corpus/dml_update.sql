@@ -0,0 +1,2 @@
+-- targets: translate, convert
+UPDATE orders SET status = 'shipped', shipped_at = getdate(), amount = amount * 1.05 WHERE id = 1001 AND status = 'paid'
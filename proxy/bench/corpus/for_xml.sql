@@ -0,0 +1,2 @@
+-- targets: translate, convert
+SELECT id, name, email FROM customers WHERE region_id = 3 FOR XML PATH('customer'), ROOT('customers')
@@ -0,0 +1,19 @@
+-- targets: sp_convert
+DECLARE @customer int, @count int
+SET @customer = 42
+CREATE TABLE #pending (order_id int, amount money)
+INSERT INTO #pending (order_id, amount) SELECT id, amount FROM orders WHERE customer_id = @customer AND status = 'paid'
+SELECT @count = count(*) FROM #pending
+IF @count = 0
+BEGIN
+    RAISERROR ('Customer %d has no pending orders', 16, 1, @customer)
+    RETURN
+END
+ELSE
+BEGIN
+    BEGIN TRANSACTION
+    UPDATE orders SET status = 'processing' WHERE id IN (SELECT order_id FROM #pending)
+    INSERT INTO audit_log (customer_id, action, created) VALUES (@customer, 'process', getdate())
+    COMMIT TRANSACTION
+END
+DROP TABLE #pending
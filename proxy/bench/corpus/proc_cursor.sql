@@ -0,0 +1,15 @@
+-- targets: convert, sp_convert
+DECLARE @id int, @amount money, @total money
+SET @total = 0
+DECLARE order_cursor CURSOR FOR
+    SELECT id, amount FROM orders WHERE status = 'paid'
+OPEN order_cursor
+FETCH NEXT FROM order_cursor INTO @id, @amount
+WHILE @@FETCH_STATUS = 0
+BEGIN
+    SET @total = @total + @amount
+    UPDATE orders SET status = 'invoiced' WHERE id = @id
+    FETCH NEXT FROM order_cursor INTO @id, @amount
+END
+CLOSE order_cursor
+DEALLOCATE order_cursor
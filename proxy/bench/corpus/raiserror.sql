@@ -0,0 +1,2 @@
+-- targets: convert, sp_convert
+RAISERROR ('Order %d not found', 16, 1, 1001)
@@ -0,0 +1,8 @@
+-- targets: translate, convert
+WITH recent AS (
+    SELECT customer_id, sum(amount) AS total FROM orders
+    WHERE created > dateadd(month, -3, getdate()) GROUP BY customer_id
+), ranked AS (
+    SELECT customer_id, total, row_number() OVER (ORDER BY total DESC) AS position FROM recent
+)
+SELECT c.name, r.total, r.position FROM ranked r JOIN customers c ON c.id = r.customer_id WHERE r.position <= 10
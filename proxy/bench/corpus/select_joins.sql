@@ -0,0 +1,13 @@
+-- targets: translate, convert
+SELECT TOP 50 c.id, c.name, r.name AS region, count(DISTINCT o.id) AS orders,
+    sum(l.quantity * p.price) AS revenue, max(s.shipped_at) AS last_shipment
+FROM customers c
+JOIN regions r ON r.id = c.region_id
+JOIN orders o ON o.customer_id = c.id
+JOIN order_lines l ON l.order_id = o.id
+JOIN products p ON p.id = l.product_id
+LEFT JOIN shipments s ON s.order_id = o.id
+WHERE o.created >= '2024-01-01' AND p.category IN ('books', 'music', 'games')
+GROUP BY c.id, c.name, r.name
+HAVING sum(l.quantity * p.price) > 1000
+ORDER BY revenue DESC
@@ -0,0 +1,21 @@
+-- targets: translate, convert
+SELECT c.id, c.name
+FROM customers c
+WHERE c.id IN (
+    SELECT o.customer_id FROM orders o
+    WHERE o.amount > (
+        SELECT avg(o2.amount) FROM orders o2
+        WHERE o2.customer_id IN (
+            SELECT c2.id FROM customers c2
+            WHERE c2.region_id = (
+                SELECT r.id FROM regions r
+                WHERE r.name = 'north' AND EXISTS (
+                    SELECT 1 FROM warehouses w
+                    WHERE w.region_id = r.id AND w.capacity > (
+                        SELECT avg(w2.capacity) FROM warehouses w2
+                    )
+                )
+            )
+        )
+    )
+)
@@ -0,0 +1,2 @@
+-- targets: translate, convert
+SELECT id, customer_id, amount, status, created FROM orders WHERE id = 1001
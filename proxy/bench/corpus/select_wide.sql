@@ -0,0 +1,67 @@
+-- targets: translate, convert
+SELECT o.col1,
+    isnull(o.note1, '') AS note1,
+    convert(varchar(20), o.created1, 112) AS day1,
+    o.col2,
+    isnull(o.note2, '') AS note2,
+    convert(varchar(20), o.created2, 112) AS day2,
+    o.col3,
+    isnull(o.note3, '') AS note3,
+    convert(varchar(20), o.created3, 112) AS day3,
+    o.col4,
+    isnull(o.note4, '') AS note4,
+    convert(varchar(20), o.created4, 112) AS day4,
+    CASE WHEN o.amount4 > 100 THEN 'large' WHEN o.amount4 > 10 THEN 'medium' ELSE 'small' END AS size4,
+    o.col5,
+    isnull(o.note5, '') AS note5,
+    convert(varchar(20), o.created5, 112) AS day5,
+    o.col6,
+    isnull(o.note6, '') AS note6,
+    convert(varchar(20), o.created6, 112) AS day6,
+    o.col7,
+    isnull(o.note7, '') AS note7,
+    convert(varchar(20), o.created7, 112) AS day7,
+    o.col8,
+    isnull(o.note8, '') AS note8,
+    convert(varchar(20), o.created8, 112) AS day8,
+    CASE WHEN o.amount8 > 100 THEN 'large' WHEN o.amount8 > 10 THEN 'medium' ELSE 'small' END AS size8,
+    o.col9,
+    isnull(o.note9, '') AS note9,
+    convert(varchar(20), o.created9, 112) AS day9,
+    o.col10,
+    isnull(o.note10, '') AS note10,
+    convert(varchar(20), o.created10, 112) AS day10,
+    o.col11,
+    isnull(o.note11, '') AS note11,
+    convert(varchar(20), o.created11, 112) AS day11,
+    o.col12,
+    isnull(o.note12, '') AS note12,
+    convert(varchar(20), o.created12, 112) AS day12,
+    CASE WHEN o.amount12 > 100 THEN 'large' WHEN o.amount12 > 10 THEN 'medium' ELSE 'small' END AS size12,
+    o.col13,
+    isnull(o.note13, '') AS note13,
+    convert(varchar(20), o.created13, 112) AS day13,
+    o.col14,
+    isnull(o.note14, '') AS note14,
+    convert(varchar(20), o.created14, 112) AS day14,
+    o.col15,
+    isnull(o.note15, '') AS note15,
+    convert(varchar(20), o.created15, 112) AS day15,
+    o.col16,
+    isnull(o.note16, '') AS note16,
+    convert(varchar(20), o.created16, 112) AS day16,
+    CASE WHEN o.amount16 > 100 THEN 'large' WHEN o.amount16 > 10 THEN 'medium' ELSE 'small' END AS size16,
+    o.col17,
+    isnull(o.note17, '') AS note17,
+    convert(varchar(20), o.created17, 112) AS day17,
+    o.col18,
+    isnull(o.note18, '') AS note18,
+    convert(varchar(20), o.created18, 112) AS day18,
+    o.col19,
+    isnull(o.note19, '') AS note19,
+    convert(varchar(20), o.created19, 112) AS day19,
+    o.col20,
+    isnull(o.note20, '') AS note20,
+    convert(varchar(20), o.created20, 112) AS day20,
+    CASE WHEN o.amount20 > 100 THEN 'large' WHEN o.amount20 > 10 THEN 'medium' ELSE 'small' END AS size20
+FROM orders o WHERE o.customer_id = 42
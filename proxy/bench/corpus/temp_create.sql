@@ -0,0 +1,2 @@
+-- targets: translate, convert
+CREATE TABLE #work (id int NOT NULL, amount money NULL, note varchar(200) NULL, created datetime DEFAULT getdate())
@@ -0,0 +1,2 @@
+-- targets: translate, convert
+SELECT id, customer_id, amount INTO #recent_orders FROM orders WHERE created > dateadd(day, -7, getdate())
@@ -0,0 +1,295 @@
+import re
+import struct
+import asyncio
+import logging
+import argparse
+
+logger = logging.getLogger("mock-postgres")
+
+PROTOCOL_VERSION = 196608
+SSL_REQUEST = 80877103
+GSSENC_REQUEST = 80877104
+CANCEL_REQUEST = 80877102
+
+# Every row-returning statement answers with the bench_items shape
+COLUMNS = (("id", 23), ("name", 25), ("amount", 1700), ("created", 1184))
+ROW_VALUES = (b"1", b"bench item", b"12.50", b"2024-01-01 00:00:00+00")
+
+PARAMETERS = {
+    "server_version": "16.0",
+    "server_encoding": "UTF8",
+    "client_encoding": "UTF8",
+    "DateStyle": "ISO, MDY",
+    "TimeZone": "UTC",
+    "integer_datetimes": "on",
+    "standard_conforming_strings": "on",
+}
+
+ROWS_RETURNED = re.compile(r"^\s*(SELECT|VALUES|TABLE|WITH|SHOW|FETCH)\b", re.IGNORECASE)
+LIMIT = re.compile(r"\bLIMIT\s+(?:\$(\d+)|(\d+))", re.IGNORECASE)
+DECLARE = re.compile(r"^\s*DECLARE\s+(\"?[\w.]+\"?).*?\bFOR\s+(.*)$", re.IGNORECASE | re.DOTALL)
+FETCH = re.compile(r"^\s*FETCH\s+(?:FORWARD\s+)?(ALL|\d+)?\s*(?:FROM|IN)?\s*(\"?[\w.]+\"?)\s*$", re.IGNORECASE)
+CLOSE = re.compile(r"^\s*CLOSE\s+(\"?[\w.]+\"?)", re.IGNORECASE)
+PLACEHOLDER = re.compile(r"\$(\d+)")
+
+def message(kind, body=b"") -> bytes:
+    return kind + struct.pack("!I", len(body) + 4) + body
+
+def _row_description() -> bytes:
+    body = struct.pack("!H", len(COLUMNS))
+    for name, oid in COLUMNS:
+        body += name.encode() + b"\0" + struct.pack("!IhIhih", 0, 0, oid, -1, -1, 0)
+    return message(b"T", body)
+
+def _data_row() -> bytes:
+    body = struct.pack("!H", len(ROW_VALUES))
+    for value in ROW_VALUES:
+        body += struct.pack("!i", len(value)) + value
+    return message(b"D", body)
+
+ROW_DESCRIPTION = _row_description()
+DATA_ROW = _data_row()
+
+class MockError(Exception):
+    pass
+
+class MockSession:
+    """One client connection speaking the PostgreSQL v3 protocol.
+
+    Enough of the simple and extended query protocols for psycopg,
+    including pipeline mode and DECLARE/FETCH cursors. Statements are not
+    executed: SELECTs return LIMIT rows (one without a LIMIT) of a fixed
+    shape, everything else succeeds with a plausible command tag, so the
+    proxy's own overhead dominates a benchmark against it.
+    """
+
+    def __init__(self, reader, writer, scan_rows):
+        self.reader = reader
+        self.writer = writer
+        self.scan_rows = scan_rows
+        self.status = b"I"
+        self.statements = {}
+        self.portals = {}
+        self.cursors = {}
+        self.failed = False
+
+    async def run(self):
+        if not await self._startup():
+            return
+        while True:
+            header = await self.reader.readexactly(5)
+            kind, size = header[:1], struct.unpack("!I", header[1:])[0]
+            body = await self.reader.readexactly(size - 4)
+            if kind == b"X":
+                return
+            if self.failed and kind != b"S":
+                # After an error the extended protocol skips to the next Sync
+                continue
+            try:
+                self._dispatch(kind, body)
+            except MockError as e:
+                self.writer.write(self._error(str(e)))
+                self.failed = kind != b"Q"
+                if kind == b"Q":
+                    self.writer.write(message(b"Z", self.status))
+            if kind in (b"Q", b"S", b"H"):
+                await self.writer.drain()
+
+    async def _startup(self) -> bool:
+        while True:
+            size = struct.unpack("!I", await self.reader.readexactly(4))[0]
+            body = await self.reader.readexactly(size - 4)
+            code = struct.unpack("!I", body[:4])[0]
+            if code in (SSL_REQUEST, GSSENC_REQUEST):
+                self.writer.write(b"N")
+                continue
+            if code != PROTOCOL_VERSION:
+                return False
+            break
+        self.writer.write(message(b"R", struct.pack("!I", 0)))
+        for name, value in PARAMETERS.items():
+            self.writer.write(message(b"S", name.encode() + b"\0" + value.encode() + b"\0"))
+        self.writer.write(message(b"K", struct.pack("!II", id(self) & 0x7FFFFFFF, 0)))
+        self.writer.write(message(b"Z", self.status))
+        await self.writer.drain()
+        return True
+
+    def _dispatch(self, kind, body):
+        if kind == b"Q":
+            sql = body[:-1].decode()
+            statements = [part for part in sql.split(";") if part.strip()]
+            if not statements:
+                self.writer.write(message(b"I"))
+            for statement in statements:
+                self._execute(statement, (), describe=True)
+            self.writer.write(message(b"Z", self.status))
+        elif kind == b"P":
+            name, pos = _cstring(body, 0)
+            sql, pos = _cstring(body, pos)
+            count = struct.unpack_from("!H", body, pos)[0]
+            self.statements[name] = (sql, count)
+            self.writer.write(message(b"1"))
+        elif kind == b"B":
+            self._bind(body)
+            self.writer.write(message(b"2"))
+        elif kind == b"D":
+            name, _ = _cstring(body, 1)
+            if body[:1] == b"S":
+                sql, count = self._statement(name)
+                count = max([count] + [int(n) for n in PLACEHOLDER.findall(sql)])
+                self.writer.write(message(b"t", struct.pack("!H", count) + struct.pack("!I", 25) * count))
+            else:
+                sql = self._portal(name)[0]
+            self.writer.write(ROW_DESCRIPTION if ROWS_RETURNED.match(sql) else message(b"n"))
+        elif kind == b"E":
+            name, _ = _cstring(body, 0)
+            self._execute(*self._portal(name))
+        elif kind == b"C":
+            name, _ = _cstring(body, 1)
+            (self.statements if body[:1] == b"S" else self.portals).pop(name, None)
+            self.writer.write(message(b"3"))
+        elif kind == b"S":
+            self.failed = False
+            self.portals.pop("", None)
+            self.writer.write(message(b"Z", self.status))
+        elif kind != b"H":
+            raise MockError(f"Unsupported message {kind!r}")
+
+    def _bind(self, body):
+        portal, pos = _cstring(body, 0)
+        name, pos = _cstring(body, pos)
+        sql, _ = self._statement(name)
+        count = struct.unpack_from("!H", body, pos)[0]
+        formats = struct.unpack_from(f"!{count}H", body, pos + 2)
+        pos += 2 + 2 * count
+        count = struct.unpack_from("!H", body, pos)[0]
+        pos += 2
+        params = []
+        for index in range(count):
+            size = struct.unpack_from("!i", body, pos)[0]
+            pos += 4
+            value = None
+            if size >= 0:
+                value = body[pos:pos + size]
+                pos += size
+                binary = formats[index if len(formats) > 1 else 0] if formats else 0
+                value = _decode_param(value, binary)
+            params.append(value)
+        self.portals[portal] = (sql, params)
+
+    def _statement(self, name):
+        if name not in self.statements:
+            raise MockError(f'prepared statement "{name}" does not exist')
+        return self.statements[name]
+
+    def _portal(self, name):
+        if name in self.cursors:
+            return f"FETCH ALL FROM {name}", ()
+        if name not in self.portals:
+            raise MockError(f'portal "{name}" does not exist')
+        return self.portals[name]
+
+    def _execute(self, sql, params, describe=False):
+        """Answer one statement; describe adds the RowDescription the
+        simple query protocol sends unasked"""
+        words = sql.split(None, 2)
+        if not words:
+            self.writer.write(message(b"I"))
+            return
+        command = words[0].upper()
+        if describe and ROWS_RETURNED.match(sql):
+            self.writer.write(ROW_DESCRIPTION)
+        declare = DECLARE.match(sql)
+        if declare:
+            self.cursors[declare.group(1).strip('"')] = self._row_count(declare.group(2), params)
+            tag = "DECLARE CURSOR"
+        elif command == "FETCH":
+            tag = f"FETCH {self._fetch(sql)}"
+        elif ROWS_RETURNED.match(sql):
+            # The proxy's temp table lookup must not see any tables
+            rows = 0 if "pg_class" in sql else self._row_count(sql, params)
+            self._rows(rows)
+            tag = f"SELECT {rows}"
+        elif command == "CLOSE":
+            name = CLOSE.match(sql).group(1).strip('"')
+            if name.upper() == "ALL":
+                self.cursors.clear()
+            else:
+                self.cursors.pop(name, None)
+            tag = "CLOSE CURSOR"
+        elif command == "INSERT":
+            tag = "INSERT 0 1"
+        elif command in ("UPDATE", "DELETE"):
+            tag = f"{command} 1"
+        else:
+            tag = command
+        if command in ("BEGIN", "START"):
+            self.status = b"T"
+        elif command in ("COMMIT", "END") or (command == "ROLLBACK" and " TO " not in sql.upper()):
+            self.status = b"I"
+        self.writer.write(message(b"C", tag.encode() + b"\0"))
+
+    def _fetch(self, sql) -> int:
+        match = FETCH.match(sql)
+        if not match:
+            raise MockError(f"Unsupported FETCH: {sql}")
+        name = match.group(2).strip('"')
+        if name not in self.cursors:
+            raise MockError(f'cursor "{name}" does not exist')
+        remaining = self.cursors[name]
+        wanted = remaining if (match.group(1) or "1").upper() == "ALL" else int(match.group(1) or 1)
+        rows = min(wanted, remaining)
+        self.cursors[name] = remaining - rows
+        self._rows(rows)
+        return rows
+
+    def _row_count(self, sql, params) -> int:
+        match = LIMIT.search(sql)
+        if not match:
+            return 1
+        if match.group(2):
+            return int(match.group(2))
+        value = params[int(match.group(1)) - 1] if int(match.group(1)) <= len(params) else None
+        return int(value) if value is not None else self.scan_rows
+
+    def _rows(self, count):
+        if count:
+            self.writer.write(DATA_ROW * count)
+
+    def _error(self, text) -> bytes:
+        fields = b"SERROR\0VERROR\0C42000\0M" + text.encode() + b"\0\0"
+        return message(b"E", fields)
+
+def _cstring(body, pos):
+    end = body.index(b"\0", pos)
+    return body[pos:end].decode(), end + 1
+
+def _decode_param(value, binary):
+    if not binary:
+        return value.decode()
+    if len(value) in (2, 4, 8):
+        return int.from_bytes(value, "big", signed=True)
+    return value
+
+async def serve(host, port, scan_rows):
+    async def on_connect(reader, writer):
+        try:
+            await MockSession(reader, writer, scan_rows).run()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(on_connect, host, port)
+    logger.info(f"Mock PostgreSQL listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PostgreSQL wire protocol stand-in for proxy benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6543)
+    parser.add_argument("--scan-rows", type=int, default=1000, help="rows for a LIMIT whose value is unknown")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.host, args.port, args.scan_rows))
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import struct
+import argparse
+import threading
+import subprocess
+import multiprocessing
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from protocol_handler import PACKET_HEADER, HEADER_SIZE, SQL_BATCH, LOGIN7, STATUS_EOM, DEFAULT_PACKET_SIZE, TDS_74
+from tds_encoder import DONE, DONE_ERROR, ENVCHANGE, ENV_PACKET_SIZE
+
+# Relative weights of each kind of request
+MIXES = {
+    "read": {"point": 90, "scan": 5, "write": 5},
+    "mixed": {"point": 60, "scan": 10, "write": 30},
+    "scan": {"scan": 100},
+    "write": {"write": 100},
+}
+
+SETUP_SQL = """
+CREATE TABLE IF NOT EXISTS bench_items (
+    id integer PRIMARY KEY,
+    name text NOT NULL,
+    amount numeric(12, 2) NOT NULL,
+    created timestamptz NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS bench_events (
+    id bigserial PRIMARY KEY,
+    item_id integer NOT NULL,
+    amount numeric(12, 2) NOT NULL
+);
+INSERT INTO bench_items (id, name, amount)
+SELECT n, 'bench item ' || n, n % 1000 / 4.0 FROM generate_series(1, {items}) AS n
+ON CONFLICT (id) DO NOTHING;
+ANALYZE bench_items;
+"""
+
+def parse_mix(text) -> dict:
+    if text in MIXES:
+        return MIXES[text]
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        if kind.strip() not in ("point", "scan", "write"):
+            raise argparse.ArgumentTypeError(f"Unknown request kind {kind!r}")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+def build_query(kind, args, rng) -> str:
+    if kind == "point":
+        return f"SELECT id, name, amount, created FROM bench_items WHERE id = {rng.randint(1, args.items)}"
+    if kind == "scan":
+        return f"SELECT TOP {args.scan_rows} id, name, amount, created FROM bench_items ORDER BY id"
+    return "\n".join(
+        f"INSERT INTO bench_events (item_id, amount) VALUES ({rng.randint(1, args.items)}, {rng.randint(1, 9999) / 100})"
+        for _ in range(args.burst)
+    )
+
+def build_message(packet_type, payload, packet_size=DEFAULT_PACKET_SIZE) -> bytes:
+    room = packet_size - HEADER_SIZE
+    chunks = [payload[i:i + room] for i in range(0, len(payload), room)] or [b""]
+    packets = bytearray()
+    for index, chunk in enumerate(chunks):
+        status = STATUS_EOM if index == len(chunks) - 1 else 0
+        packets += PACKET_HEADER.pack(packet_type, status, len(chunk) + HEADER_SIZE, 0, (index + 1) % 256, 0)
+        packets += chunk
+    return bytes(packets)
+
+def build_batch(query, packet_size=DEFAULT_PACKET_SIZE) -> bytes:
+    """SQL Batch message as TDS 7.2+ clients send it, split into packets"""
+    # ALL_HEADERS with a single transaction descriptor header
+    headers = struct.pack("<IIHQI", 22, 18, 2, 0, 1)
+    return build_message(SQL_BATCH, headers + query.encode("utf-16le"), packet_size)
+
+def build_login(packet_size) -> bytes:
+    """LOGIN7 asking for packet_size, with only the names a server logs"""
+    # host, user, password, app, server, extension, library, language, database
+    fields = [socket.gethostname(), "bench", "", "tds_load", "", "", "tds_load", "", ""]
+    start = 94
+    pairs, data = b"", b""
+    for value in fields:
+        pairs += struct.pack("<HH", start + len(data), len(value))
+        data += value.encode("utf-16le")
+    end = start + len(data)
+    # Client id, then empty SSPI, attach file and new password fields
+    tail = bytes(6) + struct.pack("<HHHHHHI", end, 0, end, 0, end, 0, 0)
+    fixed = struct.pack("<IIIIIIBBBBiI", end, TDS_74, packet_size, 7, os.getpid(), 0, 0xE0, 0x03, 0, 0, 0, 0x409)
+    return build_message(LOGIN7, fixed + pairs + tail + data)
+
+class TDSClient:
+    """Blocking client that sends SQL batches and reads whole replies.
+
+    With a packet_size it logs in first and uses the size the proxy grants.
+    """
+
+    def __init__(self, host, port, packet_size=0):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.header = bytearray(HEADER_SIZE)
+        self.packet_size = DEFAULT_PACKET_SIZE
+        if packet_size:
+            self.login(packet_size)
+
+    def login(self, packet_size):
+        self.sock.sendall(build_login(packet_size))
+        reply = bytearray()
+        while True:
+            self._recv_exact(self.header)
+            _, status, size, _, _, _ = PACKET_HEADER.unpack(self.header)
+            body = bytearray(size - HEADER_SIZE)
+            self._recv_exact(body)
+            reply += body
+            if status & STATUS_EOM:
+                break
+        # Every token before the final DONE is a type byte and a USHORT length
+        pos = 0
+        while pos < len(reply) and reply[pos] != DONE:
+            length = struct.unpack_from("<H", reply, pos + 1)[0]
+            if reply[pos] == ENVCHANGE and reply[pos + 3] == ENV_PACKET_SIZE:
+                # Type, then the new value as a B_VARCHAR
+                chars = reply[pos + 4]
+                self.packet_size = int(reply[pos + 5:pos + 5 + 2 * chars].decode("utf-16le"))
+                return
+            pos += 3 + length
+        raise ConnectionError("Login reply without a packet size")
+
+    def execute(self, packets) -> bool:
+        """Send one batch and return False if the reply ends in an error DONE"""
+        self.sock.sendall(packets)
+        tail = b""
+        while True:
+            self._recv_exact(self.header)
+            _, status, size, _, _, _ = PACKET_HEADER.unpack(self.header)
+            body = bytearray(size - HEADER_SIZE)
+            self._recv_exact(body)
+            tail = (tail + body)[-13:]
+            if status & STATUS_EOM:
+                # The reply always ends with the DONE token of the last statement
+                return len(tail) == 13 and not struct.unpack_from("<H", tail, 1)[0] & DONE_ERROR
+
+    def close(self):
+        self.sock.close()
+
+    def _recv_exact(self, buffer):
+        view = memoryview(buffer)
+        while view:
+            n = self.sock.recv_into(view)
+            if n == 0:
+                raise ConnectionError("Proxy closed the connection")
+            view = view[n:]
+
+def run_connection(args, seed, deadline, measure_from, results):
+    rng = random.Random(seed)
+    kinds = list(args.mix)
+    weights = [args.mix[kind] for kind in kinds]
+    client = TDSClient(args.host, args.port, args.packet_size)
+    try:
+        while time.monotonic() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            packets = build_batch(build_query(kind, args, rng), client.packet_size)
+            start = time.perf_counter()
+            try:
+                ok = client.execute(packets)
+            except (OSError, ConnectionError):
+                if time.monotonic() >= measure_from:
+                    results[kind][1] += 1
+                client.close()
+                client = TDSClient(args.host, args.port, args.packet_size)
+                continue
+            elapsed = time.perf_counter() - start
+            if time.monotonic() < measure_from:
+                continue
+            if ok:
+                results[kind][0].append(elapsed)
+            else:
+                results[kind][1] += 1
+    finally:
+        client.close()
+
+def run_process(args, index):
+    """One load generator process: args.connections clients on threads"""
+    # Every process starts measuring at the same moment after warmup
+    measure_from = args.start + args.warmup
+    deadline = measure_from + args.duration
+    results = {kind: [[], 0] for kind in args.mix}
+    threads = [
+        threading.Thread(
+            target=run_connection,
+            args=(args, args.seed * 1000 + index * args.connections + n, deadline, measure_from, results)
+        )
+        for n in range(args.connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {kind: (latencies, errors) for kind, (latencies, errors) in results.items()}
+
+def percentile(values, fraction) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summarize(latencies, errors, duration) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "qps": round(len(latencies) / duration, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"Nothing listening on {host}:{port} after {timeout}s")
+
+def setup_postgres(items):
+    import psycopg
+    with psycopg.connect(
+        host=os.getenv("PG_HOST"), dbname=os.getenv("PG_DB"),
+        user=os.getenv("PG_USER"), password=os.getenv("PG_PASSWORD"), autocommit=True
+    ) as conn:
+        conn.execute(SETUP_SQL.format(items=int(items)))
+
+def start_services(args) -> list:
+    """Start the mock backend and/or the proxy as child processes"""
+    processes = []
+    env = dict(os.environ)
+    if args.backend == "mock":
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "mock_postgres.py"),
+             "--port", str(args.mock_port), "--scan-rows", str(args.scan_rows)]
+        ))
+        wait_for_port("127.0.0.1", args.mock_port, 10)
+        env.update({"PG_HOST": "127.0.0.1", "PGPORT": str(args.mock_port), "PG_DB": "bench",
+                    "PG_USER": "bench", "PG_PASSWORD": "bench"})
+    elif args.backend == "postgres":
+        setup_postgres(args.items)
+    if args.backend != "none":
+        env.update({"PROXY_HOST": args.host, "PROXY_PORT": str(args.port),
+                    "PROXY_WORKERS": str(args.proxy_workers), "METRICS_PORT": str(args.metrics_port)})
+        processes.append(subprocess.Popen([sys.executable, os.path.join(SRC_DIR, "supervisor.py")], env=env))
+        wait_for_port(args.host, args.port, 30)
+    return processes
+
+def main():
+    parser = argparse.ArgumentParser(description="TDS load generator for the proxy")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--backend", choices=("none", "mock", "postgres"), default="none",
+                        help="none: use a running proxy; mock/postgres: start the proxy against that backend")
+    parser.add_argument("--mock-port", type=int, default=6543)
+    parser.add_argument("--metrics-port", type=int, default=9191)
+    parser.add_argument("--proxy-workers", type=int, default=1)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--connections", type=int, default=8, help="client connections per process")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before the run")
+    parser.add_argument("--mix", type=parse_mix, default="read",
+                        help=f"{', '.join(MIXES)} or weights such as point=80,scan=10,write=10")
+    parser.add_argument("--items", type=int, default=10000, help="rows in bench_items")
+    parser.add_argument("--scan-rows", type=int, default=1000)
+    parser.add_argument("--burst", type=int, default=20, help="INSERT statements per write batch")
+    parser.add_argument("--packet-size", type=int, default=0,
+                        help="log in asking for this TDS packet size; 0 sends batches without a login")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--max-p99-ms", type=float, help="fail if the overall p99 is above this")
+    parser.add_argument("--min-qps", type=float, help="fail if the overall QPS is below this")
+    args = parser.parse_args()
+
+    services = start_services(args)
+    try:
+        args.start = time.monotonic()
+        with multiprocessing.get_context("fork").Pool(args.processes) as pool:
+            runs = pool.starmap(run_process, [(args, index) for index in range(args.processes)])
+    finally:
+        for process in reversed(services):
+            process.terminate()
+            process.wait()
+
+    report = {"mix": args.mix, "processes": args.processes, "connections": args.processes * args.connections,
+              "duration": args.duration, "workloads": {}}
+    everything, total_errors = [], 0
+    for kind in args.mix:
+        latencies = [value for run in runs for value in run[kind][0]]
+        errors = sum(run[kind][1] for run in runs)
+        report["workloads"][kind] = summarize(latencies, errors, args.duration)
+        everything += latencies
+        total_errors += errors
+    report["total"] = summarize(everything, total_errors, args.duration)
+
+    print(f"{'workload':<10}{'requests':>10}{'errors':>8}{'qps':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for kind, stats in list(report["workloads"].items()) + [("total", report["total"])]:
+        print(f"{kind:<10}{stats['requests']:>10}{stats['errors']:>8}{stats['qps']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.max_p99_ms is not None and report["total"]["p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 {report['total']['p99_ms']}ms above {args.max_p99_ms}ms")
+    if args.min_qps is not None and report["total"]["qps"] < args.min_qps:
+        failures.append(f"{report['total']['qps']} QPS below {args.min_qps}")
+    if total_errors:
+        failures.append(f"{total_errors} requests failed")
+    if failures:
+        print("FAILED: " + "; ".join(failures))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
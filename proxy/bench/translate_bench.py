@@ -0,0 +1,180 @@
+import os
+import re
+import gc
+import sys
+import json
+import time
+import glob
+import logging
+import argparse
+import platform
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "..", "migration", "src"))
+
+import sqlglot
+from query_handler import QueryHandler
+from sybase_converter import SybaseConverter
+from sp_converter import SPConverter
+
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines", "translation.json")
+
+# sqlglot warns on every parse of syntax it falls back on
+logging.getLogger("sqlglot").setLevel(logging.ERROR)
+
+# First line of every corpus file: "-- targets: translate, convert"
+TARGETS_HEADER = re.compile(r"^--\s*targets:\s*(.+)$", re.MULTILINE)
+
+def load_corpus(pattern=None) -> list:
+    cases = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "*.sql"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if pattern and pattern not in name:
+            continue
+        with open(path) as f:
+            text = f.read()
+        header = TARGETS_HEADER.search(text)
+        targets = [target.strip() for target in header.group(1).split(",")] if header else ["translate"]
+        sql = TARGETS_HEADER.sub("", text, count=1).strip()
+        cases.append((name, targets, sql))
+    return cases
+
+def build_calls(target, name, sql) -> list:
+    """(label, setup, call) pairs measured for one corpus case and target"""
+    if target == "translate":
+        handler = QueryHandler()
+
+        def cold():
+            handler.cache.clear()
+            handler.shapes.clear()
+
+        # Cold is a first sighting of the statement, cached is every later one
+        return [
+            ("translate", cold, lambda: handler.translate(sql)),
+            ("translate_cached", lambda: None, lambda: handler.translate(sql)),
+        ]
+    if target == "convert":
+        converter = SybaseConverter()
+        return [("convert", lambda: None, lambda: converter.convert(sql))]
+    if target == "sp_convert":
+        converter = SPConverter()
+        rows = [(line,) for line in sql.splitlines()]
+        return [("sp_convert", lambda: None, lambda: converter.convert(name, rows))]
+    raise ValueError(f"Unknown target {target} in corpus case {name}")
+
+def measure(setup, call, iterations, warmup) -> dict:
+    try:
+        for _ in range(warmup):
+            setup()
+            call()
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {str(e)}"[:200]}
+
+    timings = []
+    gc.collect()
+    for _ in range(iterations):
+        setup()
+        start = time.perf_counter_ns()
+        call()
+        timings.append(time.perf_counter_ns() - start)
+    timings.sort()
+
+    # A separate traced run, tracemalloc slows the call down several times
+    setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        call()
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_us": round(timings[len(timings) // 2] / 1000, 1),
+        "p95_us": round(timings[min(len(timings) - 1, int(0.95 * len(timings)))] / 1000, 1),
+        "min_us": round(timings[0] / 1000, 1),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+def run(cases, iterations, warmup) -> dict:
+    results = {}
+    for name, targets, sql in cases:
+        for target in targets:
+            for label, setup, call in build_calls(target, name, sql):
+                results[f"{name}/{label}"] = measure(setup, call, iterations, warmup)
+    return results
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "sqlglot": sqlglot.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor() or platform.machine(),
+    }
+
+def print_results(results, baseline=None):
+    print(f"{'case':<38}{'median us':>11}{'p95 us':>10}{'peak KiB':>10}{'vs base':>9}")
+    for key, stats in results.items():
+        if "error" in stats:
+            print(f"{key:<38}  {stats['error']}")
+            continue
+        change = ""
+        previous = (baseline or {}).get(key)
+        if previous and "median_us" in previous:
+            change = f"{(stats['median_us'] / previous['median_us'] - 1) * 100:+.0f}%"
+        print(f"{key:<38}{stats['median_us']:>11}{stats['p95_us']:>10}{stats['peak_kib']:>10}{change:>9}")
+
+def regressions(results, baseline, max_regression) -> list:
+    found = []
+    for key, previous in baseline.items():
+        current = results.get(key)
+        if current is None or "error" in previous:
+            continue
+        if "error" in current:
+            found.append(f"{key} now fails: {current['error']}")
+        elif current["median_us"] > previous["median_us"] * (1 + max_regression):
+            found.append(f"{key} median {previous['median_us']}us -> {current['median_us']}us")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-statement T-SQL translation benchmark")
+    parser.add_argument("--filter", help="only corpus cases whose name contains this")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--save", nargs="?", const=DEFAULT_BASELINE, help="write results as the baseline")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="compare against a saved baseline")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="fail the comparison when a median grows by more than this fraction")
+    args = parser.parse_args()
+
+    results = run(load_corpus(args.filter), args.iterations, args.warmup)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        if saved["environment"] != environment():
+            print(f"Baseline was taken on {saved['environment']}, this run is {environment()}")
+        baseline = saved["results"]
+    print_results(results, baseline)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.max_regression)
+        if found:
+            print("Regressions:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
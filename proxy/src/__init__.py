@@ -2,13 +2,10 @@
 __version__ = "1.0.0"
 __all__ = ['main', 'query_handler', 'connection_manager', 'protocol_handler', 'tds_handler', 'metrics','sybase_converter']
 
-# Initialize logging configuration
-import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
-# Initialize connection pool on package load
-from .connection_manager import ConnectionManager
-connection_pool = ConnectionManager()
\ No newline at end of file
+# Importing the package has no side effects: logging is configured by the
+# entry points and the connection pool is only created when first asked for
+def __getattr__(name):
+    if name == "connection_pool":
+        from .connection_manager import ConnectionManager
+        return ConnectionManager()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,42 +1,134 @@
 import os
-import psycopg2
-from psycopg2 import pool
-from prometheus_client import Gauge
+import time
+import asyncio
+import logging
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger("connection-manager")
+
+async def configure_connection(conn):
+    # Per-backend LRU of server-side prepared statements; psycopg
+    # deallocates the least recently used one when it is full
+    conn.prepared_max = int(os.getenv("PG_PREPARED_MAX", 100))
+    warmup_query = os.getenv("PG_WARMUP_QUERY")
+    if warmup_query:
+        # Prime catalog and plan caches before the connection serves clients
+        await conn.execute(warmup_query)
+
+def connection_kwargs(host, port=None) -> dict:
+    kwargs = {
+        "host": host,
+        "dbname": os.getenv("PG_DB"),
+        "user": os.getenv("PG_USER"),
+        "password": os.getenv("PG_PASSWORD"),
+        "autocommit": True,
+        # Auto-parameterized statements get server-side prepared
+        # after this many executions on a connection
+        "prepare_threshold": int(os.getenv("PG_PREPARE_THRESHOLD", 5))
+    }
+    if port:
+        kwargs["port"] = port
+    temp_buffers = os.getenv("TEMP_BUFFERS")
+    if temp_buffers:
+        # Only settable before a session first touches a temp table, and
+        # as a startup option it survives the RESET ALL between clients
+        kwargs["options"] = f"-c temp_buffers={temp_buffers}"
+    return kwargs
 
 class ConnectionManager:
+    """Process-wide PostgreSQL connection pool.
+
+    Waiters are served first come, first served and give up after
+    PG_POOL_TIMEOUT seconds. Connections are recycled after
+    PG_MAX_LIFETIME seconds, idle ones are checked every
+    PG_HEALTH_CHECK_INTERVAL seconds, and with PG_POOL_WARMUP startup waits
+    until PG_MIN_CONN primed connections are open.
+    """
     _instance = None
 
     def __init__(self):
+        if hasattr(self, 'metrics'):
+            return
         self.metrics = {
-            'active': Gauge('db_connections_active', 'Active connections'),
-            'waiting': Gauge('db_connections_waiting', 'Pending connection requests'),
-            'usage': Histogram('db_connection_usage', 'Connection hold time')
+            'active': Gauge('db_connections_active', 'Active connections', multiprocess_mode='livesum'),
+            'waiting': Gauge('db_connections_waiting', 'Pending connection requests', multiprocess_mode='livesum'),
+            'wait': Histogram('db_connection_wait', 'Connection checkout wait time'),
+            'usage': Histogram('db_connection_usage', 'Connection hold time'),
+            'errors': Counter('db_connection_errors', 'Pool timeouts and failed reconnects')
         }
+        self.warmup = os.getenv("PG_POOL_WARMUP", "false").lower() == "true"
+        self.health_check_interval = float(os.getenv("PG_HEALTH_CHECK_INTERVAL", 30))
+        self._checked_out = {}
+        self._health_task = None
 
     def __new__(cls):
         if not cls._instance:
             cls._instance = super().__new__(cls)
-            cls._instance.pool = psycopg2.pool.ThreadedConnectionPool(
-                minconn=int(os.getenv("PG_MIN_CONN", 5)),
-                maxconn=int(os.getenv("PG_MAX_CONN", 20)),
-                host=os.getenv("PG_HOST"),
-                database=os.getenv("PG_DB"),
-                user=os.getenv("PG_USER"),
-                password=os.getenv("PG_PASSWORD")
+            check_on_checkout = os.getenv("PG_CHECK_ON_CHECKOUT", "false").lower() == "true"
+            cls._instance.pool = AsyncConnectionPool(
+                kwargs=connection_kwargs(os.getenv("PG_HOST")),
+                min_size=int(os.getenv("PG_MIN_CONN", 5)),
+                max_size=int(os.getenv("PG_MAX_CONN", 20)),
+                configure=configure_connection,
+                # Costs a round trip per checkout, so off unless asked for
+                check=AsyncConnectionPool.check_connection if check_on_checkout else None,
+                timeout=float(os.getenv("PG_POOL_TIMEOUT", 30)),
+                max_waiting=int(os.getenv("PG_MAX_WAITING", 0)),
+                max_lifetime=float(os.getenv("PG_MAX_LIFETIME", 3600)),
+                max_idle=float(os.getenv("PG_MAX_IDLE", 600)),
+                reconnect_failed=cls._reconnect_failed,
+                name="proxy",
+                open=False
             )
         return cls._instance
-        
 
-    def get_conn(self):
-        start = time.time()
-        conn = self.pool.getconn()
+    async def open(self):
+        await self.pool.open(wait=self.warmup, timeout=self.pool.timeout)
+        if self.warmup:
+            logger.info(f"Connection pool warmed up with {self.pool.min_size} connections")
+        if self.health_check_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._check_health())
+
+    async def get_conn(self):
+        start = time.perf_counter()
+        self.metrics['waiting'].inc()
+        try:
+            conn = await self.pool.getconn()
+        except PoolTimeout:
+            self.metrics['errors'].inc()
+            raise
+        finally:
+            self.metrics['waiting'].dec()
+            self.metrics['wait'].observe(time.perf_counter() - start)
+        self._checked_out[conn] = time.perf_counter()
         self.metrics['active'].inc()
-        self.metrics['usage'].observe(time.time() - start)
         return conn
 
-    def put_conn(self, conn):
-        self.pool.putconn(conn)
+    async def put_conn(self, conn):
+        start = self._checked_out.pop(conn, None)
+        if start is not None:
+            self.metrics['usage'].observe(time.perf_counter() - start)
+        await self.pool.putconn(conn)
         self.metrics['active'].dec()
 
-    def close_all(self):
-        self.pool.closeall()
+    async def close_all(self):
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        await self.pool.close()
+
+    @classmethod
+    def _reconnect_failed(cls, pool):
+        cls._instance.metrics['errors'].inc()
+        logger.error(f"Pool {pool.name} could not reconnect to PostgreSQL")
+
+    async def _check_health(self):
+        # Idle connections are probed and broken ones replaced, so a
+        # failover is noticed before clients check a dead backend out
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await self.pool.check()
+            except Exception as e:
+                logger.error(f"Pool health check failed: {str(e)}")
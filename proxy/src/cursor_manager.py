@@ -0,0 +1,184 @@
+import os
+import time
+import asyncio
+import logging
+import psycopg
+
+logger = logging.getLogger("cursor-manager")
+
+# sp_cursoropen scroll options
+SCROLL_FORWARD_ONLY = 0x0004
+SCROLL_FAST_FORWARD = 0x0010
+
+# sp_cursorfetch fetch types
+FETCH_FIRST = 0x0001
+FETCH_NEXT = 0x0002
+FETCH_PREV = 0x0004
+FETCH_LAST = 0x0008
+FETCH_ABSOLUTE = 0x0010
+FETCH_RELATIVE = 0x0020
+
+class ClientCursor:
+    def __init__(self, handle, name, scrollable, conn, held):
+        self.handle = handle
+        self.name = name
+        self.scrollable = scrollable
+        # Connection the cursor lives on, and whether it is the session's
+        # pinned one, holding the cursor past transaction ends
+        self.conn = conn
+        self.held = held
+        self.description = None
+        # 1-based row the last fetch started at, and how many it returned
+        self.position = 0
+        self.fetched = 0
+        self.last_used = time.monotonic()
+
+class CursorManager:
+    """Backs client API cursors with PostgreSQL named cursors.
+
+    A cursor opened while the session keeps no state on a backend is
+    declared inside a transaction on a connection of its own, held until
+    its last cursor closes. PostgreSQL then produces rows as they are
+    fetched, and the client's own statements keep going through the pool.
+    One opened inside a client transaction, or over #temp tables, has to
+    live on the session's pinned backend. It is declared WITH HOLD to
+    outlive the client's COMMIT like SQL Server cursors do, and that
+    COMMIT materializes whatever the cursor has not returned yet. Cursors
+    idle for CURSOR_IDLE_TIMEOUT seconds are closed.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.idle_timeout = float(os.getenv("CURSOR_IDLE_TIMEOUT", 300))
+        self.max_cursors = int(os.getenv("MAX_CURSORS_PER_SESSION", 100))
+        self.cursors = {}
+        self._next_handle = 180150001
+        self._reaper = None
+        # The connection of cursors declared outside the session's state
+        self._own = None
+
+    async def open(self, sql, params, scroll_options=0) -> ClientCursor:
+        if len(self.cursors) >= self.max_cursors:
+            raise ValueError(f"Session exceeded {self.max_cursors} open cursors")
+        # Any state but cursors, an open transaction or temp tables, is
+        # only visible on the pinned backend
+        held = bool(self.session.pins - {"cursor"})
+        conn = await self.session.pin("cursor") if held else await self._own_conn()
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_idle())
+        handle = self._next_handle
+        self._next_handle += 1
+        scrollable = not scroll_options & (SCROLL_FORWARD_ONLY | SCROLL_FAST_FORWARD)
+        cursor = ClientCursor(handle, f"proxy_cursor_{handle}", scrollable, conn, held)
+        scroll = "SCROLL" if scrollable else "NO SCROLL"
+        hold = " WITH HOLD" if held else ""
+        try:
+            await conn.execute(f'DECLARE "{cursor.name}" {scroll} CURSOR{hold} FOR {sql}', params)
+            # Describe the result shape without moving the cursor
+            cur = await conn.execute(f'FETCH FORWARD 0 FROM "{cursor.name}"')
+            cursor.description = cur.description
+        except Exception:
+            await self._release()
+            raise
+        self.cursors[handle] = cursor
+        return cursor
+
+    async def fetch(self, handle, fetch_type, row_number, count):
+        """Return (description, rows) for one sp_cursorfetch call"""
+        cursor = self._get(handle)
+        conn = self._conn(cursor)
+        cursor.last_used = time.monotonic()
+        count = max(count, 1)
+        if not cursor.scrollable and fetch_type != FETCH_NEXT:
+            raise ValueError("Cursor is forward-only")
+
+        if fetch_type == FETCH_NEXT:
+            start = cursor.position + cursor.fetched if cursor.position else 1
+        elif fetch_type == FETCH_FIRST:
+            start = 1
+        elif fetch_type == FETCH_PREV:
+            start = max(1, cursor.position - count)
+        elif fetch_type == FETCH_ABSOLUTE:
+            start = max(1, row_number)
+        elif fetch_type == FETCH_RELATIVE:
+            start = max(1, cursor.position + row_number)
+        elif fetch_type == FETCH_LAST:
+            await conn.execute(f'MOVE ABSOLUTE 0 IN "{cursor.name}"')
+            total = (await conn.execute(f'MOVE FORWARD ALL IN "{cursor.name}"')).rowcount
+            start = max(1, total - count + 1)
+        else:
+            raise ValueError(f"Unsupported cursor fetch type 0x{fetch_type:04x}")
+
+        # Sequential NEXT fetches need no repositioning
+        current = cursor.position + cursor.fetched - 1 if cursor.position else 0
+        if start - 1 != current or fetch_type == FETCH_LAST:
+            await conn.execute(f'MOVE ABSOLUTE {start - 1} IN "{cursor.name}"')
+        cur = await conn.execute(f'FETCH FORWARD {count} FROM "{cursor.name}"')
+        rows = await cur.fetchall()
+        cursor.position = start
+        cursor.fetched = len(rows)
+        return cursor.description, rows
+
+    async def close(self, handle):
+        cursor = self._get(handle)
+        del self.cursors[handle]
+        try:
+            await self._conn(cursor).execute(f'CLOSE "{cursor.name}"')
+        finally:
+            await self._release()
+
+    async def close_all(self):
+        self.cursors.clear()
+        await self._release()
+
+    def _get(self, handle) -> ClientCursor:
+        cursor = self.cursors.get(handle)
+        if cursor is None:
+            raise ValueError(f"Could not find cursor with handle {handle}")
+        return cursor
+
+    def _conn(self, cursor):
+        lost = self.session.conn is not cursor.conn if cursor.held else cursor.conn.closed
+        if lost:
+            raise ValueError("Cursor backend connection was lost")
+        return cursor.conn
+
+    async def _own_conn(self):
+        if self._own is None:
+            conn = await self.session.checkout()
+            try:
+                # Cursors without HOLD only live inside a transaction
+                await conn.execute("BEGIN")
+            except BaseException:
+                await self.session.checkin(conn)
+                raise
+            self._own = conn
+        return self._own
+
+    async def _release(self):
+        """Give up the connections no open cursor lives on any more"""
+        if self._own is not None and not any(not cursor.held for cursor in self.cursors.values()):
+            conn, self._own = self._own, None
+            # Ending the transaction closes whatever cursors are left on it
+            await self.session.checkin(conn)
+        if "cursor" in self.session.pins and not any(cursor.held for cursor in self.cursors.values()):
+            await self.session.unpin("cursor")
+        if not self.cursors:
+            if self._reaper and self._reaper is not asyncio.current_task():
+                self._reaper.cancel()
+            self._reaper = None
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 1))
+            now = time.monotonic()
+            for cursor in list(self.cursors.values()):
+                if now - cursor.last_used > self.idle_timeout:
+                    logger.info(f"Closing idle cursor {cursor.handle}")
+                    try:
+                        await self.close(cursor.handle)
+                    except (ValueError, psycopg.Error) as e:
+                        # The cursor is forgotten either way, keep reaping the rest
+                        logger.error(f"Closing idle cursor {cursor.handle} failed: {str(e)}")
+            if not self.cursors:
+                return
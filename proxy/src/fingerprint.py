@@ -0,0 +1,522 @@
+import re
+from decimal import Decimal
+from sqlglot import exp
+from translation_cache import RESERVED_WORDS
+
+_TOKENS = re.compile(r"""
+    (?P<string>N?'(?:[^']|'')*')
+  | (?P<ident>"(?:[^"]|"")*"|\[(?:[^\]]|\]\])*\])
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<space>\s+)
+  | (?P<hex>0[xX][0-9A-Fa-f]*)
+  | (?P<word>[@#$A-Za-z_][@#$A-Za-z0-9_]*)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+""", re.VERBOSE | re.DOTALL)
+_PLACEHOLDER = re.compile(r":p(\d+)\b")
+
+# Statements PostgreSQL accepts bind parameters in
+PARAMETERIZABLE = (exp.Select, exp.Insert, exp.Update, exp.Delete, exp.SetOperation)
+# Positions where a bound value behaves exactly like the literal it replaces
+SAFE_PARENTS = (
+    exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE,
+    exp.In, exp.Between, exp.Like, exp.ILike,
+    exp.Limit, exp.Offset, exp.Fetch,
+)
+
+def fingerprint_sql(query: str):
+    """Lift string and numeric literals out of a T-SQL statement.
+
+    Returns the normalized statement with literals replaced by :pN
+    placeholders, and the raw literal texts in placeholder order.
+    """
+    parts = []
+    literals = []
+    pos = 0
+    for match in _TOKENS.finditer(query):
+        parts.append(query[pos:match.start()])
+        kind = match.lastgroup
+        text = match.group()
+        if kind in ("string", "number"):
+            parts.append(f":p{len(literals)}")
+            literals.append(text)
+        elif kind == "word":
+            upper = text.upper()
+            parts.append(upper if upper in RESERVED_WORDS else text)
+        elif kind in ("comment", "space"):
+            parts.append(" ")
+        else:
+            parts.append(text)
+        pos = match.end()
+    parts.append(query[pos:])
+    return "".join(parts).strip(), literals
+
+def bind_variables(statement: str, names) -> str:
+    """Turn declared @variables of a prepared statement into :name placeholders"""
+    def replace(match):
+        text = match.group()
+        if match.lastgroup == "word" and text[1:] in names and text[0] == "@":
+            return ":" + text[1:]
+        return text
+    return _TOKENS.sub(replace, statement)
+
+def inline_literals(fingerprint: str, literals, positions) -> str:
+    """Put the original literal text back for the given placeholder positions"""
+    def replace(match):
+        index = int(match.group(1))
+        return literals[index] if index in positions else match.group()
+    return _PLACEHOLDER.sub(replace, fingerprint)
+
+def literal_value(text: str):
+    if text.endswith("'"):
+        start = 2 if text[0] in "Nn" else 1
+        return text[start:-1].replace("''", "'")
+    if text.isdigit():
+        return int(text)
+    if "e" in text or "E" in text:
+        return float(text)
+    return Decimal(text)
+
+def unsafe_positions(expression, count) -> frozenset:
+    """Placeholder positions that must stay literal for the translation to hold.
+
+    Anything outside plain DML, or used as an ordinal, type argument,
+    style code or operand of arithmetic, changes meaning once it is bound.
+    """
+    if not isinstance(expression, PARAMETERIZABLE):
+        return frozenset(range(count))
+    unsafe = set(range(count))
+    for node in expression.find_all(exp.Placeholder):
+        if not node.name.startswith("p") or not node.name[1:].isdigit():
+            continue
+        parent = node.parent
+        if isinstance(parent, exp.Tuple):
+            safe = isinstance(parent.parent, exp.Values)
+        elif isinstance(parent, exp.Binary) and isinstance(parent, SAFE_PARENTS):
+            # Two bound values compared to each other leave nothing to infer a type from
+            safe = not isinstance(parent.left, exp.Placeholder) or not isinstance(parent.right, exp.Placeholder)
+        elif isinstance(parent, (exp.In, exp.Between)):
+            safe = parent.this is not node and not isinstance(parent.this, exp.Placeholder)
+        else:
+            safe = isinstance(parent, SAFE_PARENTS)
+        if safe:
+            unsafe.discard(int(node.name[1:]))
+    return frozenset(unsafe)
+
+# Keywords that open a new statement when a batch leaves out semicolons
+STATEMENT_STARTS = frozenset("""
+    ALTER BEGIN COMMIT CREATE DECLARE DELETE DROP EXEC EXECUTE INSERT MERGE
+    PRINT ROLLBACK SAVE SELECT SET TRUNCATE UPDATE WITH
+""".split())
+# Control flow and module definitions are sent through as a single statement
+UNSPLITTABLE = frozenset("""
+    IF WHILE GOTO RETURN BREAK CONTINUE TRY CATCH PROC PROCEDURE FUNCTION TRIGGER VIEW
+""".split())
+_TRANSACTION_WORDS = frozenset(("TRAN", "TRANSACTION", "DISTRIBUTED"))
+# SET options that only shape the client session and mean nothing to PostgreSQL
+SESSION_OPTIONS = frozenset("""
+    NOCOUNT ANSI_NULLS ANSI_PADDING ANSI_WARNINGS ANSI_NULL_DFLT_ON ARITHABORT ARITHIGNORE
+    CONCAT_NULL_YIELDS_NULL QUOTED_IDENTIFIER NUMERIC_ROUNDABORT XACT_ABORT TEXTSIZE DEADLOCK_PRIORITY
+""".split())
+_SESSION_SET = re.compile(r"^SET\s+(\w+(?:\s*,\s*\w+)*)\s+(?:ON|OFF|LOW|NORMAL|HIGH|-?\d+)$", re.IGNORECASE)
+# Keyword that carries the main clause of a statement started by the key
+_BODY_WORDS = {
+    "INSERT": frozenset(("SELECT", "VALUES", "EXEC", "EXECUTE", "DEFAULT")),
+    "WITH": frozenset(("SELECT", "INSERT", "UPDATE", "DELETE", "MERGE")),
+    "UPDATE": frozenset(("SET",)),
+}
+_SELECT_FOLLOWS = frozenset(("UNION", "ALL", "EXCEPT", "INTERSECT", "AS", "FOR", "DISTINCT", "("))
+_DML_FOLLOWS = frozenset(("THEN", "FOR", "AFTER", "OF", "INSTEAD", ",", "("))
+_ALTER_CLAUSES = frozenset(("ALTER", "DROP", "SET", "ADD"))
+_PERMISSIONS = frozenset(("GRANT", "REVOKE", "DENY"))
+
+def _batch_tokens(query: str):
+    """Significant tokens as (text, upper-case word or punctuation, start, end)"""
+    tokens = []
+    pos = 0
+    for match in _TOKENS.finditer(query):
+        for offset, char in enumerate(query[pos:match.start()]):
+            if not char.isspace():
+                tokens.append((char, char, pos + offset, pos + offset + 1))
+        pos = match.end()
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            continue
+        text = match.group()
+        tokens.append((text, text.upper() if kind == "word" else kind, match.start(), pos))
+    for offset, char in enumerate(query[pos:]):
+        if not char.isspace():
+            tokens.append((char, char, pos + offset, pos + offset + 1))
+    return tokens
+
+def _starts_statement(word, prev, head, body_seen, following) -> bool:
+    if word not in STATEMENT_STARTS or head in _PERMISSIONS:
+        return False
+    if head == "ALTER" and word in _ALTER_CLAUSES:
+        return False
+    if head in _BODY_WORDS and not body_seen and word in _BODY_WORDS[head]:
+        return False
+    if word == "SELECT":
+        return prev not in _SELECT_FOLLOWS
+    if word in ("INSERT", "UPDATE", "DELETE", "MERGE"):
+        if prev == "ON":
+            # ON DELETE / ON UPDATE referential actions, not SET ... ON
+            return head not in ("ALTER", "CREATE")
+        return prev not in _DML_FOLLOWS
+    if word == "SET":
+        return prev not in ("UPDATE", "DELETE")
+    if word == "WITH":
+        # A CTE reads "WITH name AS (" or "WITH name (columns)"; table hints
+        # and options such as WITH (NOLOCK) or WITH TIES stay put
+        return len(following) > 1 and following[0][1] in ("word", "quoted") and following[1][1] in ("AS", "(")
+    return True
+
+def split_batch(query: str) -> list:
+    """Split a T-SQL batch into statements.
+
+    Statements end at top-level semicolons or where a keyword clearly opens
+    the next one. Batches with control flow, module definitions or
+    @variables, which live for the whole batch, come back whole. SET
+    options that only shape the client session are dropped.
+    """
+    tokens = _batch_tokens(query)
+    statements = []
+    start = None
+    depth = 0
+    head = prev = None
+    body_seen = False
+    for index, (text, word, begin, end) in enumerate(tokens):
+        if word in UNSPLITTABLE or (word[0] == "@" and not word.startswith("@@")) or (word == "BEGIN" and (
+                index + 1 == len(tokens) or tokens[index + 1][1] not in _TRANSACTION_WORDS)):
+            return [query.strip()] if query.strip() else []
+        if word == ";" and depth == 0:
+            if start is not None:
+                statements.append(query[start:begin].strip())
+            start = head = prev = None
+            body_seen = False
+            continue
+        if start is not None and depth == 0 and _starts_statement(word, prev, head, body_seen, tokens[index + 1:index + 3]):
+            statements.append(query[start:begin].strip())
+            start = None
+        if start is None:
+            start, head, body_seen = begin, word, False
+        elif depth == 0 and head in _BODY_WORDS and word in _BODY_WORDS[head]:
+            body_seen = True
+        if word == "(":
+            depth += 1
+        elif word == ")":
+            depth = max(depth - 1, 0)
+        prev = word
+    if start is not None:
+        statements.append(query[start:].strip())
+    return [statement for statement in statements if not _session_option(statement)]
+
+def _session_option(statement) -> bool:
+    match = _SESSION_SET.match(statement)
+    return bool(match) and all(name.strip().upper() in SESSION_OPTIONS for name in match.group(1).split(","))
+
+_PASSTHROUGH_TOKENS = re.compile(r"""
+    (?P<string>[Nn]?'(?:[^']|'')*')
+  | (?P<ident>"(?:[^"]|"")*"|\[(?:[^\]]|\]\])*\])
+  | (?P<space>\s+|--[^\n]*|/\*.*?\*/)
+  | (?P<other>0[xX][0-9A-Fa-f]*)
+  | (?P<placeholder>:[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?(?![A-Za-z_]))
+  | (?P<op><>|!=|<=|>=|[=<>(),.*;])
+  | (?P<any>.)
+""", re.VERBOSE | re.DOTALL)
+# Bare words sqlglot reads as functions or literals rather than columns
+_NOT_COLUMNS = frozenset((
+    "CURRENT_TIMESTAMP", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_USER", "SESSION_USER",
+    "SYSTEM_USER", "USER", "TRUE", "FALSE",
+))
+_COMPARISONS = {"=": "=", "<>": "<>", "!=": "<>", "<": "<", ">": ">", "<=": "<=", ">=": ">="}
+_DIRTY_READ_HINTS = frozenset(("NOLOCK", "READUNCOMMITTED"))
+
+class _NotPassthrough(Exception):
+    pass
+
+class _Passthrough:
+    """Recursive descent over the statement shapes both dialects read alike.
+
+    Identifiers come out double quoted, as the full translation quotes
+    them, :name placeholders become %(name)s and literals are kept.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.tables = set()
+
+    def statement(self):
+        word = self._keyword("SELECT", "INSERT", "UPDATE", "DELETE", "BEGIN", "COMMIT", "ROLLBACK", "SAVE")
+        if word == "SELECT":
+            sql = self._select()
+        elif word == "INSERT":
+            sql = self._insert()
+        elif word == "UPDATE":
+            sql = self._update()
+        elif word == "DELETE":
+            sql = self._delete()
+        elif word == "BEGIN":
+            # A bare BEGIN opens a T-SQL block, not a transaction
+            if not self._keyword("TRAN", "TRANSACTION"):
+                raise _NotPassthrough()
+            sql = "BEGIN"
+        elif word == "SAVE":
+            if not self._keyword("TRAN", "TRANSACTION"):
+                raise _NotPassthrough()
+            sql = f"SAVEPOINT {self._identifier()}"
+        elif word:
+            # ROLLBACK TRAN name may mean a savepoint or the whole transaction
+            self._keyword("TRAN", "TRANSACTION", "WORK")
+            sql = word
+        else:
+            raise _NotPassthrough()
+        if self.pos != len(self.tokens):
+            raise _NotPassthrough()
+        return sql, frozenset(self.tables), word == "SELECT"
+
+    def _select(self) -> str:
+        parts = ["SELECT"]
+        if self._keyword("DISTINCT"):
+            parts.append("DISTINCT")
+        columns = [self._column()]
+        while self._punct(","):
+            columns.append(self._column())
+        parts.append(", ".join(columns))
+        if not self._keyword("FROM"):
+            raise _NotPassthrough()
+        parts.append(f"FROM {self._table()}")
+        if self._keyword("WHERE"):
+            parts.append(f"WHERE {self._condition()}")
+        return " ".join(parts)
+
+    def _insert(self) -> str:
+        self._keyword("INTO")
+        parts = [f"INSERT INTO {self._name(table=True)}"]
+        if self._punct("("):
+            columns = [self._identifier()]
+            while self._punct(","):
+                columns.append(self._identifier())
+            self._expect(")")
+            parts.append(f"({', '.join(columns)})")
+        if not self._keyword("VALUES"):
+            raise _NotPassthrough()
+        rows = [self._row()]
+        while self._punct(","):
+            rows.append(self._row())
+        parts.append(f"VALUES {', '.join(rows)}")
+        return " ".join(parts)
+
+    def _update(self) -> str:
+        parts = [f"UPDATE {self._name(table=True)}"]
+        if not self._keyword("SET"):
+            raise _NotPassthrough()
+        assignments = [self._assignment()]
+        while self._punct(","):
+            assignments.append(self._assignment())
+        parts.append(f"SET {', '.join(assignments)}")
+        if self._keyword("WHERE"):
+            parts.append(f"WHERE {self._condition()}")
+        return " ".join(parts)
+
+    def _delete(self) -> str:
+        self._keyword("FROM")
+        parts = [f"DELETE FROM {self._name(table=True)}"]
+        if self._keyword("WHERE"):
+            parts.append(f"WHERE {self._condition()}")
+        return " ".join(parts)
+
+    def _column(self) -> str:
+        if self._punct("*"):
+            return "*"
+        parts = [self._identifier()]
+        while self._punct("."):
+            if self._punct("*"):
+                return ".".join(parts) + ".*"
+            parts.append(self._identifier())
+        self._not_a_call()
+        return ".".join(parts) + self._alias()
+
+    def _table(self) -> str:
+        name = self._name(table=True) + self._alias()
+        # Dirty-read hints have no PostgreSQL equivalent and are dropped
+        if self._keyword("WITH"):
+            self._expect("(")
+        elif not self._punct("("):
+            return name
+        self._hint()
+        while self._punct(","):
+            self._hint()
+        self._expect(")")
+        return name
+
+    def _hint(self):
+        if not self._keyword(*_DIRTY_READ_HINTS):
+            raise _NotPassthrough()
+
+    def _alias(self) -> str:
+        kind, text = self._peek()
+        if self._keyword("AS") or kind == "ident" or (kind == "word" and text.upper() not in RESERVED_WORDS):
+            return f" AS {self._identifier()}"
+        return ""
+
+    def _name(self, table=False) -> str:
+        parts = [self._identifier()]
+        while self._punct("."):
+            parts.append(self._identifier())
+        if len(parts) > 3:
+            raise _NotPassthrough()
+        if table:
+            self.tables.add(parts[-1][1:-1].replace('""', '"').lower())
+        return ".".join(parts)
+
+    def _identifier(self) -> str:
+        kind, text = self._peek()
+        if kind == "word":
+            if text.upper() in RESERVED_WORDS or text.upper() in _NOT_COLUMNS:
+                raise _NotPassthrough()
+            name = text
+        elif kind == "ident":
+            name = text[1:-1].replace("]]", "]") if text[0] == "[" else text[1:-1].replace('""', '"')
+            if not name:
+                raise _NotPassthrough()
+        else:
+            raise _NotPassthrough()
+        self.pos += 1
+        return '"' + name.replace('"', '""') + '"'
+
+    def _assignment(self) -> str:
+        column = self._identifier()
+        self._expect("=")
+        return f"{column} = {self._operand()}"
+
+    def _row(self) -> str:
+        self._expect("(")
+        values = [self._value()]
+        while self._punct(","):
+            values.append(self._value())
+        self._expect(")")
+        return f"({', '.join(values)})"
+
+    def _condition(self) -> str:
+        terms = [self._term()]
+        while self._keyword("OR"):
+            terms.append(self._term())
+        return " OR ".join(terms)
+
+    def _term(self) -> str:
+        factors = [self._factor()]
+        while self._keyword("AND"):
+            factors.append(self._factor())
+        return " AND ".join(factors)
+
+    def _factor(self) -> str:
+        if self._keyword("NOT"):
+            return f"NOT {self._factor()}"
+        if self._punct("("):
+            inner = self._condition()
+            self._expect(")")
+            return f"({inner})"
+        # A column on the left keeps every bound value typed by its column
+        column = self._name()
+        self._not_a_call()
+        if self._keyword("IS"):
+            negated = "NOT " if self._keyword("NOT") else ""
+            if not self._keyword("NULL"):
+                raise _NotPassthrough()
+            return f"{column} IS {negated}NULL"
+        negated = "NOT " if self._keyword("NOT") else ""
+        if self._keyword("IN"):
+            self._expect("(")
+            values = [self._value()]
+            while self._punct(","):
+                values.append(self._value())
+            self._expect(")")
+            return f"{column} {negated}IN ({', '.join(values)})"
+        if self._keyword("LIKE"):
+            return f"{column} {negated}LIKE {self._operand()}"
+        if self._keyword("BETWEEN"):
+            low = self._operand()
+            if not self._keyword("AND"):
+                raise _NotPassthrough()
+            return f"{column} {negated}BETWEEN {low} AND {self._operand()}"
+        if negated:
+            raise _NotPassthrough()
+        kind, text = self._peek()
+        if kind != "op" or text not in _COMPARISONS:
+            raise _NotPassthrough()
+        self.pos += 1
+        return f"{column} {_COMPARISONS[text]} {self._operand()}"
+
+    def _operand(self) -> str:
+        kind, text = self._peek()
+        if kind == "ident" or (kind == "word" and text.upper() != "NULL"):
+            column = self._name()
+            self._not_a_call()
+            return column
+        return self._value()
+
+    def _not_a_call(self):
+        if self._peek() == ("op", "("):
+            raise _NotPassthrough()
+
+    def _value(self) -> str:
+        kind, text = self._peek()
+        if kind == "string":
+            self.pos += 1
+            return text[1:] if text[0] in "Nn" else text
+        if kind == "number":
+            self.pos += 1
+            return text
+        if kind == "placeholder":
+            self.pos += 1
+            return f"%({text[1:]})s"
+        if self._keyword("NULL"):
+            return "NULL"
+        raise _NotPassthrough()
+
+    def _peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None, None
+
+    def _keyword(self, *words):
+        kind, text = self._peek()
+        if kind == "word" and text.upper() in words:
+            self.pos += 1
+            return text.upper()
+        return None
+
+    def _punct(self, char) -> bool:
+        if self._peek() == ("op", char):
+            self.pos += 1
+            return True
+        return False
+
+    def _expect(self, char):
+        if not self._punct(char):
+            raise _NotPassthrough()
+
+def passthrough_sql(query: str):
+    """PostgreSQL for a statement that needs no real translation, or None.
+
+    Covers transaction control and single-table SELECT, INSERT, UPDATE
+    and DELETE with plain comparisons, which only need identifiers
+    quoted and a few keywords rewritten. Returns (sql, tables, read_only);
+    anything else, or anything ambiguous, is None and goes to sqlglot.
+    """
+    tokens = []
+    for match in _PASSTHROUGH_TOKENS.finditer(query):
+        kind = match.lastgroup
+        if kind in ("other", "any"):
+            return None
+        if kind != "space":
+            tokens.append((kind, match.group()))
+    if tokens and tokens[-1] == ("op", ";"):
+        tokens.pop()
+    try:
+        return _Passthrough(tokens).statement()
+    except _NotPassthrough:
+        return None
@@ -1,62 +1,197 @@
+import time
+# Taken before the imports below so the startup report includes them
+STARTED = time.perf_counter()
+
 import os
 import socket
+import signal
+import asyncio
 import logging
-from protocol_handler import TDSProtocolHandler
+from concurrent.futures import ThreadPoolExecutor
+from psycopg import AsyncPipeline, capabilities
+from protocol_handler import TDSProtocolHandler, MAX_PACKET_SIZE
+from tds_handler import TDSHandler
 from connection_manager import ConnectionManager
+from replica_router import ReplicaRouter
+from result_cache import ResultCache
+from slow_query_log import SlowQueryLog
 from query_handler import QueryHandler
+from metrics import StartupTimer
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("proxy-main")
 
+def socket_options() -> list:
+    """(level, option, value) for every client socket, from the environment"""
+    options = []
+    if os.getenv("TCP_NODELAY", "true").lower() == "true":
+        # Every reply ends in a small packet that Nagle would hold back
+        # until the client acknowledges the previous one
+        options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+    for name, option in (("SOCKET_SEND_BUFFER", socket.SO_SNDBUF), ("SOCKET_RECV_BUFFER", socket.SO_RCVBUF)):
+        size = int(os.getenv(name, 0))
+        if size > 0:
+            options.append((socket.SOL_SOCKET, option, size))
+    return options
+
+def parse_limits(value) -> dict:
+    """"name=seconds,name=seconds" as a dict keyed by lower-cased name"""
+    limits = {}
+    for item in value.split(","):
+        name, _, limit = item.partition("=")
+        if limit:
+            limits[name.strip().lower()] = float(limit)
+    return limits
+
+def create_listener(host, port, backlog, reuse_port=False):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Each worker binds its own socket and the kernel balances accepts
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # The receive buffer only sets the TCP window scale if it is in place
+    # before the handshake, so accepted sockets have to inherit it
+    for option in socket_options():
+        s.setsockopt(*option)
+    s.bind((host, port))
+    s.listen(backlog)
+    return s
+
 class ProxyServer:
-    def __init__(self):
+    def __init__(self, startup=None):
+        self.startup = startup or StartupTimer()
         self.host = os.getenv("PROXY_HOST", "0.0.0.0")
         self.port = int(os.getenv("PROXY_PORT", 5000))
+        self.max_connections = int(os.getenv("MAX_CONNECTIONS", 100))
+        self.backlog = int(os.getenv("LISTEN_BACKLOG", socket.SOMAXCONN))
+        self.drain_timeout = float(os.getenv("DRAIN_TIMEOUT", 30))
+        self.flush_size = int(os.getenv("RESULT_FLUSH_SIZE", 64 * 1024))
+        self.fetch_size = int(os.getenv("STREAM_FETCH_SIZE", 2000))
+        self.stream_results = os.getenv("STREAM_RESULTS", "stream").lower()
+        # libpq 17 hands a streamed result over in chunks, older ones row by row
+        self.stream_chunk_size = self.fetch_size if capabilities.has_stream_chunked() else 1
+        self.memory_limit = int(os.getenv("SESSION_MEMORY_LIMIT", 64 * 1024 * 1024))
+        self.flush_size = min(self.flush_size, self.memory_limit // 2)
+        self.max_packet_size = min(int(os.getenv("TDS_MAX_PACKET_SIZE", MAX_PACKET_SIZE)), MAX_PACKET_SIZE)
+        self.socket_options = socket_options()
+        # Statements running longer are cancelled on PostgreSQL, 0 disables.
+        # Per statement type ("select=30,update=10") and per client
+        # application name sent in LOGIN7, which takes precedence
+        self.statement_timeout = float(os.getenv("STATEMENT_TIMEOUT", 0))
+        self.statement_timeouts = parse_limits(os.getenv("STATEMENT_TIMEOUTS", ""))
+        self.client_timeouts = parse_limits(os.getenv("CLIENT_STATEMENT_TIMEOUTS", ""))
+        self.pipeline_batches = (
+            os.getenv("PIPELINE_BATCHES", "true").lower() == "true" and AsyncPipeline.is_supported()
+        )
+        self.startup.mark("config")
         self.protocol = TDSProtocolHandler()
         self.connections = ConnectionManager()
+        self.replicas = ReplicaRouter()
+        self.result_cache = ResultCache()
+        self.slow_log = SlowQueryLog(self.connections)
         self.query_handler = QueryHandler()
+        # Translation is CPU bound, keep it off the event loop but bounded
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("TRANSLATE_WORKERS", 4)),
+            thread_name_prefix="translate"
+        )
+        self.sessions = set()
+        self.busy = set()
+        self.draining = False
+        self.startup.mark("setup")
+
+    def start(self, sock=None, reuse_port=False):
+        asyncio.run(self.serve(sock, reuse_port))
+
+    async def serve(self, sock=None, reuse_port=False):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
 
-    def start(self):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind((self.host, self.port))
-            s.listen(int(os.getenv("MAX_CONNECTIONS", 100)))
-            logger.info(f"Sybase proxy listening on {self.host}:{self.port}")
-            
-            while True:
-                conn, addr = s.accept()
-                logger.info(f"New connection from {addr}")
-                self.handle_connection(conn)
-
-    def handle_connection(self, conn):
+        self.slow_log.start()
+        self.query_handler.start()
+        self.startup.mark("translator")
+        await self.connections.open()
+        self.startup.mark("pool_open")
+        await self.replicas.open()
+        self.startup.mark("replicas")
+        await self.result_cache.open()
+        self.startup.mark("result_cache")
+        if sock is None:
+            sock = create_listener(self.host, self.port, self.backlog, reuse_port)
+        sock.setblocking(False)
+        self.startup.mark("listen")
+        logger.info(f"Sybase proxy listening on {self.host}:{self.port} (pid {os.getpid()})")
+        self.startup.report(logger)
+
+        accepter = asyncio.create_task(self._accept_loop(sock))
+        stopper = asyncio.create_task(stop.wait())
         try:
-            while True:
-                data = conn.recv(4096)
-                if not data:
-                    break
-                
-                query = self.protocol.parse_query(data)
-                translated = self.query_handler.translate(query)
-                result = self.execute_query(translated)
-                response = self.protocol.build_response(result)
-                conn.send(response)
-                
-        except Exception as e:
-            logger.error(f"Connection error: {str(e)}")
+            await asyncio.wait([accepter, stopper], return_when=asyncio.FIRST_COMPLETED)
+            if accepter.done():
+                accepter.result()
         finally:
-            conn.close()
+            accepter.cancel()
+            stopper.cancel()
+            sock.close()
+            await self.drain()
+            await self.result_cache.close()
+            await self.replicas.close()
+            await self.connections.close_all()
+            self.executor.shutdown(wait=False)
+            self.query_handler.stop()
+            self.slow_log.stop()
+
+    async def _accept_loop(self, sock):
+        loop = asyncio.get_running_loop()
+        # One slot per client session; when all are taken we stop calling
+        # accept() and let the kernel backlog hold new clients
+        slots = asyncio.Semaphore(self.max_connections)
+        while True:
+            await slots.acquire()
+            try:
+                conn, addr = await loop.sock_accept(sock)
+            except OSError as e:
+                slots.release()
+                logger.error(f"Accept failed: {str(e)}")
+                continue
+            logger.info(f"New connection from {addr}")
+            task = asyncio.create_task(self._serve_client(conn, slots))
+            self.sessions.add(task)
+            task.add_done_callback(self.sessions.discard)
 
-    def execute_query(self, query):
-        pg_conn = self.connections.get_conn()
+    async def drain(self):
+        self.draining = True
+        if not self.sessions:
+            return
+        logger.info(f"Draining {len(self.sessions)} client sessions")
+        # Idle sessions are closed right away, busy ones finish their request
+        for task in self.sessions - self.busy:
+            task.cancel()
+        _, pending = await asyncio.wait(self.sessions, timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _serve_client(self, conn, slots):
         try:
-            with pg_conn.cursor() as cursor:
-                cursor.execute(query)
-                if cursor.description:
-                    return cursor.fetchall()
-                pg_conn.commit()
-                return cursor.rowcount
+            conn.setblocking(False)
+            for option in self.socket_options:
+                conn.setsockopt(*option)
+            await self.handle_connection(conn)
         finally:
-            self.connections.put_conn(pg_conn)
+            conn.close()
+            slots.release()
+
+    async def handle_connection(self, conn):
+        await TDSHandler(conn, self).handle_client()
 
 if __name__ == "__main__":
-    ProxyServer().start()
+    from prometheus_client import start_http_server
+    logging.basicConfig(level=logging.INFO)
+    startup = StartupTimer(STARTED)
+    startup.mark("imports")
+    # Single-process mode; under the supervisor it serves the metrics instead
+    start_http_server(int(os.getenv("METRICS_PORT", 9100)))
+    startup.mark("metrics")
+    ProxyServer(startup).start()
@@ -1,11 +1,164 @@
-from prometheus_client import Gauge, Counter, Histogram
+import os
+import random
+import threading
+from time import perf_counter
 
-PROXY_METRICS = {
-    'active_connections': Gauge('proxy_db_active_connections', 'Current active connections'),
-    'connection_errors': Counter('proxy_db_connection_errors', 'Connection errors'),
-    'query_duration': Histogram('proxy_query_duration', 'Query execution time', ['query_type']),
-    'conversion_errors': Counter('proxy_conversion_errors', 'Conversion failures', ['error_type']),
-}
+# Request phases run from tens of microseconds (parse) to seconds (execute)
+PHASE_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+STATEMENT_TYPES = frozenset((
+    "select", "insert", "update", "delete", "merge", "with", "set",
+    "create", "drop", "alter", "truncate", "begin", "commit", "rollback"
+))
+
+def _create_metrics() -> dict:
+    from prometheus_client import Gauge, Counter, Histogram
+    return {
+        'active_connections': Gauge('proxy_db_active_connections', 'Current active connections'),
+        'connection_errors': Counter('proxy_db_connection_errors', 'Connection errors'),
+        'query_duration': Histogram('proxy_query_duration', 'Query execution time', ['query_type'], buckets=PHASE_BUCKETS),
+        'phase_duration': Histogram(
+            'proxy_phase_duration_seconds', 'Time spent per request phase', ['phase', 'statement_type'], buckets=PHASE_BUCKETS
+        ),
+        'conversion_errors': Counter('proxy_conversion_errors', 'Conversion failures', ['error_type']),
+        'translation_cache_hits': Counter('proxy_translation_cache_hits', 'Translation cache hits', ['cache']),
+        'translation_cache_misses': Counter('proxy_translation_cache_misses', 'Translation cache misses', ['cache']),
+        'translation_cache_evictions': Counter('proxy_translation_cache_evictions', 'Translation cache evictions', ['cache']),
+        'translation_cache_entries': Gauge('proxy_translation_cache_entries', 'Cached translations', ['cache'], multiprocess_mode='livesum'),
+        'translations': Counter('proxy_translations', 'Statements translated, by fast path or sqlglot', ['path']),
+        'temp_tables_full': Counter('proxy_temp_tables_full', 'Writes refused because a temp table is over MAX_TEMP_TABLE_SIZE'),
+        'cancelled_requests': Counter('proxy_cancelled_requests', 'Requests cancelled on the backend', ['reason']),
+        'pinned_sessions': Gauge('proxy_pinned_sessions', 'Sessions holding a dedicated backend', multiprocess_mode='livesum'),
+        'routed_statements': Counter('proxy_routed_statements', 'Read-only statements by the backend that ran them', ['target']),
+        'result_cache_hits': Counter('proxy_result_cache_hits', 'Result cache hits'),
+        'result_cache_misses': Counter('proxy_result_cache_misses', 'Result cache misses'),
+        'result_cache_invalidations': Counter('proxy_result_cache_invalidations', 'Cached results dropped by writes'),
+        'result_cache_bytes': Gauge('proxy_result_cache_bytes', 'Bytes of cached results', multiprocess_mode='livesum'),
+        'replica_pool_timeouts': Counter('proxy_replica_pool_timeouts', 'Reads sent to the primary because a replica pool was exhausted', ['replica']),
+        'replica_lag': Gauge('proxy_replica_lag_seconds', 'Replication lag seen by the proxy', ['replica'], multiprocess_mode='max'),
+        'startup_duration': Gauge('proxy_startup_seconds', 'Time spent per startup phase', ['phase'], multiprocess_mode='max'),
+    }
+
+class _ProxyMetrics(dict):
+    """Metric name -> collector, registered on first use.
+
+    Importing the translator then neither loads prometheus_client nor
+    touches its registry, and the supervisor can pick the multiprocess
+    backend before any metric exists.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def __missing__(self, name):
+        with self._lock:
+            if not len(self):
+                self.update(_create_metrics())
+        if name not in self:
+            raise KeyError(name)
+        return dict.__getitem__(self, name)
+
+PROXY_METRICS = _ProxyMetrics()
 
 def track_conversion_error(error_type: str):
-    PROXY_METRICS['conversion_errors'].labels(error_type).inc()
\ No newline at end of file
+    PROXY_METRICS['conversion_errors'].labels(error_type).inc()
+
+def statement_type(sql: str) -> str:
+    """Metric label for a translated statement, from its leading keyword"""
+    word = sql.lstrip(" \t\r\n(").split(None, 1)[0].lower() if sql.strip() else ""
+    return word if word in STATEMENT_TYPES else "other"
+
+class RequestTimer:
+    """Accumulates wall time per phase for one sampled client request.
+
+    mark(phase) books the time since the previous mark to phase, so the
+    streaming loop can alternate execute, encode and send cheaply.
+    """
+    __slots__ = ("statement_type", "phases", "started", "sampled", "_last")
+
+    def __init__(self, started=None, sampled=True):
+        self.statement_type = None
+        self.sampled = sampled
+        self.phases = {}
+        self._last = perf_counter()
+        self.started = started if started is not None else self._last
+        if started is not None:
+            self.phases["read"] = self._last - started
+
+    def mark(self, phase):
+        now = perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def classify(self, label):
+        if self.statement_type is None:
+            self.statement_type = label
+
+    @property
+    def total(self) -> float:
+        return self._last - self.started
+
+    def finish(self):
+        if not self.sampled:
+            return
+        label = self.statement_type or "other"
+        histogram = PROXY_METRICS['phase_duration']
+        for phase, seconds in self.phases.items():
+            histogram.labels(phase, label).observe(seconds)
+        PROXY_METRICS['query_duration'].labels(label).observe(self.total)
+
+class _UnsampledTimer:
+    __slots__ = ()
+    statement_type = None
+
+    def mark(self, phase):
+        pass
+
+    def classify(self, label):
+        pass
+
+    def finish(self):
+        pass
+
+UNSAMPLED = _UnsampledTimer()
+SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", 0.1))
+
+def start_request_timer(started=None, always=False):
+    """A RequestTimer for a METRICS_SAMPLE_RATE share of requests, else a no-op.
+
+    With always, every request is timed but only the sample is recorded.
+    """
+    sampled = SAMPLE_RATE >= 1.0 or random.random() < SAMPLE_RATE
+    if sampled or always:
+        return RequestTimer(started, sampled)
+    return UNSAMPLED
+
+class StartupTimer:
+    """Wall time of each startup phase, reported once the proxy listens.
+
+    mark(phase) books the time since the previous mark, like RequestTimer.
+    """
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else perf_counter()
+        self.phases = {}
+        self._last = self.started
+
+    def mark(self, phase):
+        now = perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return self._last - self.started
+
+    def report(self, logger):
+        phases = ", ".join(f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in self.phases.items())
+        logger.info(f"Started in {self.total * 1000:.1f}ms ({phases})")
+        gauge = PROXY_METRICS['startup_duration']
+        for phase, seconds in self.phases.items():
+            gauge.labels(phase).set(seconds)
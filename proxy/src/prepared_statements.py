@@ -0,0 +1,63 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger("prepared-statements")
+
+_PARAM_NAME = re.compile(r"@([\w@#$]+)")
+
+def parse_param_names(declaration) -> list:
+    """Parameter names, in order, from an sp_prepare declaration like '@P1 int, @P2 nvarchar(50)'"""
+    if not declaration:
+        return []
+    return _PARAM_NAME.findall(declaration)
+
+class PreparedStatement:
+    def __init__(self, handle, translation, names, source=None):
+        self.handle = handle
+        self.translation = translation
+        self.source = source
+        self.sql = translation.sql
+        self.names = names
+
+    def bind(self, values) -> dict:
+        if len(values) > len(self.names):
+            raise ValueError(f"Prepared statement {self.handle} takes {len(self.names)} parameters, got {len(values)}")
+        params = dict.fromkeys(self.names)
+        params.update(zip(self.names, values))
+        return params
+
+class PreparedStatementManager:
+    """Client statement handles for one TDS session.
+
+    Handles map to an already translated PostgreSQL template, so
+    sp_execute never goes back through sqlglot. Planning is reused through
+    psycopg's per-connection prepared statement cache (PG_PREPARED_MAX).
+    """
+
+    def __init__(self):
+        self.max_handles = int(os.getenv("MAX_PREPARED_HANDLES", 1000))
+        self.statements = {}
+        self._next_handle = 1
+
+    def prepare(self, translation, names, source=None) -> PreparedStatement:
+        if len(self.statements) >= self.max_handles:
+            raise ValueError(f"Session exceeded {self.max_handles} prepared statements")
+        handle = self._next_handle
+        self._next_handle += 1
+        statement = PreparedStatement(handle, translation, names, source)
+        self.statements[handle] = statement
+        return statement
+
+    def get(self, handle) -> PreparedStatement:
+        statement = self.statements.get(handle)
+        if statement is None:
+            raise ValueError(f"Could not find prepared statement with handle {handle}")
+        return statement
+
+    def unprepare(self, handle):
+        if self.statements.pop(handle, None) is None:
+            logger.warning(f"sp_unprepare for unknown handle {handle}")
+
+    def clear(self):
+        self.statements.clear()
@@ -1,30 +1,402 @@
 import struct
+import asyncio
 import logging
+import uuid
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from time import perf_counter
 
 logger = logging.getLogger("tds-protocol")
 
+# TDS packet types
+SQL_BATCH = 0x01
+RPC = 0x03
+REPLY = 0x04
+ATTENTION = 0x06
+LOGIN7 = 0x10
+PRELOGIN = 0x12
+
+# Packet header: type, status, length, spid, packet id, window
+PACKET_HEADER = struct.Struct('>BBHHBB')
+HEADER_SIZE = PACKET_HEADER.size
+STATUS_EOM = 0x01
+DEFAULT_PACKET_SIZE = 4096
+MIN_PACKET_SIZE = 512
+MAX_PACKET_SIZE = 32767
+# Oldest and newest TDS versions we answer LOGIN7 with. Replies use
+# 7.2 token formats (PLP columns, 8-byte DONE row counts) throughout.
+TDS_72 = 0x72090002
+TDS_74 = 0x74000004
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+# Well-known system procedures RPC clients send by id instead of by name
+SP_PROC_IDS = {
+    1: 'sp_cursor', 2: 'sp_cursoropen', 3: 'sp_cursorprepare', 4: 'sp_cursorexecute',
+    5: 'sp_cursorprepexec', 6: 'sp_cursorunprepare', 7: 'sp_cursorfetch',
+    8: 'sp_cursoroption', 9: 'sp_cursorclose', 10: 'sp_executesql', 11: 'sp_prepare',
+    12: 'sp_execute', 13: 'sp_prepexec', 14: 'sp_prepexecrpc', 15: 'sp_unprepare',
+}
+RPC_BATCH_FLAGS = (0x80, 0xFF)
+PLP_NULL = 0xFFFFFFFFFFFFFFFF
+
+# Parameter TYPE_INFO families
+FIXED_LEN_TYPES = {0x1F: 0, 0x30: 1, 0x32: 1, 0x34: 2, 0x38: 4, 0x3A: 4, 0x3B: 4,
+                   0x3C: 8, 0x3D: 8, 0x3E: 8, 0x7A: 4, 0x7F: 8}
+BYTE_LEN_TYPES = (0x24, 0x26, 0x68, 0x6D, 0x6E, 0x6F)
+DECIMAL_TYPES = (0x6A, 0x6C)
+SCALED_TIME_TYPES = (0x29, 0x2A, 0x2B)
+DATEN = 0x28
+CHAR_TYPES = (0xA7, 0xAF)
+NCHAR_TYPES = (0xE7, 0xEF)
+BINARY_TYPES = (0xA5, 0xAD)
+
+SQL_DATETIME_EPOCH = datetime(1900, 1, 1)
+
+# LOGIN7 fixed part, then (offset, length) pairs for the variable fields
+LOGIN_HEADER = struct.Struct('<IIIIII')
+LOGIN_FIELDS = ('host', 'user', 'password', 'app', 'server', 'extension', 'library', 'language', 'database')
+LOGIN_FIELDS_OFFSET = 36
+
+Login = namedtuple('Login', 'tds_version packet_size host user app server library language database')
+RPCRequest = namedtuple('RPCRequest', 'name flags params')
+RPCParam = namedtuple('RPCParam', 'name value output')
+
+class TDSProtocolError(Exception):
+    """Raised when the client sends a malformed TDS stream"""
+    pass
+
+class TDSPacketReader:
+    """Reads whole TDS messages from a non-blocking socket.
+
+    Packets are received straight into a preallocated buffer with
+    recv_into(). A single-packet message is returned as a view into that
+    buffer; multi-packet messages are reassembled into a second reusable
+    buffer. Returned views are only valid until the next read_message().
+    """
+
+    def __init__(self, sock, packet_size=DEFAULT_PACKET_SIZE, max_message_size=MAX_MESSAGE_SIZE):
+        self.sock = sock
+        self.max_message_size = max_message_size
+        self._recv = bytearray(2 * max(packet_size, DEFAULT_PACKET_SIZE))
+        self._start = 0
+        self._end = 0
+        self._message = bytearray(max(packet_size, DEFAULT_PACKET_SIZE))
+        self.packet_size = packet_size
+        self.message_started = 0.0
+
+    async def read_message(self):
+        """Return (packet_type, payload) for the next message, or None on EOF"""
+        if not await self._fill(HEADER_SIZE, at_boundary=True):
+            return None
+        # Client think time before the first header is not part of the read
+        self.message_started = perf_counter()
+        packet_type, status, size = self._peek_header()
+        if status & STATUS_EOM:
+            await self._fill(size)
+            payload = memoryview(self._recv)[self._start + HEADER_SIZE:self._start + size]
+            self._start += size
+            return packet_type, payload
+
+        length = 0
+        while True:
+            await self._fill(size)
+            payload_size = size - HEADER_SIZE
+            if length + payload_size > self.max_message_size:
+                raise TDSProtocolError(f"Message exceeds {self.max_message_size} bytes")
+            self._reserve(length + payload_size)
+            begin = self._start + HEADER_SIZE
+            self._message[length:length + payload_size] = self._recv[begin:begin + payload_size]
+            length += payload_size
+            self._start += size
+            if status & STATUS_EOM:
+                return packet_type, memoryview(self._message)[:length]
+            await self._fill(HEADER_SIZE)
+            _, status, size = self._peek_header()
+
+    def _peek_header(self):
+        packet_type, status, size, _, _, _ = PACKET_HEADER.unpack_from(self._recv, self._start)
+        if size < HEADER_SIZE:
+            raise TDSProtocolError(f"Invalid packet length {size}")
+        return packet_type, status, size
+
+    async def _fill(self, needed, at_boundary=False):
+        loop = asyncio.get_running_loop()
+        while self._end - self._start < needed:
+            if len(self._recv) - self._start < needed:
+                self._compact(needed)
+            n = await loop.sock_recv_into(self.sock, memoryview(self._recv)[self._end:])
+            if n == 0:
+                if at_boundary and self._end == self._start:
+                    return False
+                raise ConnectionError("Client closed connection mid-packet")
+            self._end += n
+        return True
+
+    def _compact(self, needed):
+        pending = self._end - self._start
+        if len(self._recv) < needed:
+            # Views handed out earlier may still pin the old buffer, so
+            # allocate a new one rather than resizing in place
+            buf = bytearray(max(needed, 2 * self.packet_size))
+            buf[:pending] = self._recv[self._start:self._end]
+            self._recv = buf
+        else:
+            self._recv[:pending] = self._recv[self._start:self._end]
+        self._start = 0
+        self._end = pending
+
+    def _reserve(self, size):
+        if len(self._message) < size:
+            buf = bytearray(max(size, 2 * len(self._message)))
+            buf[:len(self._message)] = self._message
+            self._message = buf
+
+class TDSPacketWriter:
+    """Splits an outgoing token stream into packets of the negotiated size.
+
+    Tokens are appended to the packet under construction; full packets are
+    sealed with their header and queued until flush() sends them.
+    """
+
+    def __init__(self, sock, packet_size=DEFAULT_PACKET_SIZE, packet_type=REPLY):
+        self.sock = sock
+        self.packet_size = packet_size
+        self.packet_type = packet_type
+        self._packet_id = 1
+        self._current = bytearray(HEADER_SIZE)
+        self._pending = bytearray()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            if len(self._current) >= self.packet_size:
+                self._seal(0)
+            room = self.packet_size - len(self._current)
+            self._current += view[:room]
+            view = view[room:]
+
+    async def flush(self):
+        if self._pending:
+            data, self._pending = self._pending, bytearray()
+            await asyncio.get_running_loop().sock_sendall(self.sock, data)
+
+    async def end_message(self):
+        self._seal(STATUS_EOM)
+        self._packet_id = 1
+        await self.flush()
+
+    def _seal(self, status):
+        PACKET_HEADER.pack_into(
+            self._current, 0, self.packet_type, status, len(self._current), 0, self._packet_id, 0
+        )
+        self._pending += self._current
+        del self._current[HEADER_SIZE:]
+        self._packet_id = (self._packet_id + 1) % 256
+
+class _PayloadReader:
+    def __init__(self, payload, pos=0):
+        self.data = payload
+        self.pos = pos
+
+    def remaining(self) -> int:
+        return len(self.data) - self.pos
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def byte(self) -> int:
+        return self.unpack('<B')[0]
+
+    def ushort(self) -> int:
+        return self.unpack('<H')[0]
+
+    def read(self, size) -> bytes:
+        if size > self.remaining():
+            raise TDSProtocolError("Truncated RPC parameter")
+        data = bytes(self.data[self.pos:self.pos + size])
+        self.pos += size
+        return data
+
+    def b_varchar(self) -> str:
+        return self.read(self.byte() * 2).decode('utf-16le')
+
+    def plp(self):
+        total = self.unpack('<Q')[0]
+        if total == PLP_NULL:
+            return None
+        chunks = []
+        while True:
+            size = self.unpack('<I')[0]
+            if size == 0:
+                return b''.join(chunks)
+            chunks.append(self.read(size))
+
+def _decode_int(data, signed=True):
+    return int.from_bytes(data, 'little', signed=signed)
+
+def _decode_fixed(type_id, data):
+    if type_id == 0x1F:
+        return None
+    if type_id == 0x30:
+        return data[0]
+    if type_id == 0x32:
+        return bool(data[0])
+    if type_id in (0x34, 0x38, 0x7F):
+        return _decode_int(data)
+    if type_id == 0x3B:
+        return struct.unpack('<f', data)[0]
+    if type_id == 0x3E:
+        return struct.unpack('<d', data)[0]
+    if type_id == 0x3C:
+        high, low = struct.unpack('<iI', data)
+        return Decimal((high << 32) | low).scaleb(-4)
+    if type_id == 0x7A:
+        return Decimal(_decode_int(data)).scaleb(-4)
+    if type_id == 0x3D:
+        days, ticks = struct.unpack('<iI', data)
+        return SQL_DATETIME_EPOCH + timedelta(days=days, milliseconds=ticks * 10 / 3)
+    if type_id == 0x3A:
+        days, minutes = struct.unpack('<HH', data)
+        return SQL_DATETIME_EPOCH + timedelta(days=days, minutes=minutes)
+    raise TDSProtocolError(f"Unsupported RPC parameter type 0x{type_id:02x}")
+
+def _decode_byte_len(type_id, data):
+    if type_id == 0x24:
+        return uuid.UUID(bytes_le=data)
+    if type_id == 0x26:
+        return _decode_int(data, signed=len(data) > 1)
+    if type_id == 0x68:
+        return bool(data[0])
+    if type_id == 0x6D:
+        return struct.unpack('<f' if len(data) == 4 else '<d', data)[0]
+    if type_id == 0x6E:
+        return _decode_fixed(0x3C if len(data) == 8 else 0x7A, data)
+    return _decode_fixed(0x3D if len(data) == 8 else 0x3A, data)
+
+def _decode_time(data, scale) -> timedelta:
+    ticks = _decode_int(data, signed=False)
+    if scale <= 6:
+        return timedelta(microseconds=ticks * 10 ** (6 - scale))
+    return timedelta(microseconds=ticks // 10 ** (scale - 6))
+
+def _decode_date(data) -> date:
+    return date.fromordinal(_decode_int(data, signed=False) + 1)
+
+def _decode_scaled_time(type_id, data, scale):
+    if type_id == 0x29:
+        return (datetime.min + _decode_time(data, scale)).time()
+    time_size = len(data) - 3 - (2 if type_id == 0x2B else 0)
+    value = datetime.combine(_decode_date(data[time_size:time_size + 3]), time()) + _decode_time(data[:time_size], scale)
+    if type_id == 0x2B:
+        offset = timedelta(minutes=_decode_int(data[-2:]))
+        return (value + offset).replace(tzinfo=timezone(offset))
+    return value
+
+def read_typed_value(reader):
+    """Decode one TYPE_INFO + value pair from an RPC parameter"""
+    type_id = reader.byte()
+    if type_id in FIXED_LEN_TYPES:
+        return _decode_fixed(type_id, reader.read(FIXED_LEN_TYPES[type_id]))
+    if type_id in BYTE_LEN_TYPES:
+        reader.byte()
+        size = reader.byte()
+        return _decode_byte_len(type_id, reader.read(size)) if size else None
+    if type_id in DECIMAL_TYPES:
+        _, _, scale = reader.unpack('<BBB')
+        size = reader.byte()
+        if not size:
+            return None
+        data = reader.read(size)
+        value = Decimal(_decode_int(data[1:], signed=False)).scaleb(-scale)
+        return value if data[0] else -value
+    if type_id == DATEN:
+        size = reader.byte()
+        return _decode_date(reader.read(size)) if size else None
+    if type_id in SCALED_TIME_TYPES:
+        scale = reader.byte()
+        size = reader.byte()
+        return _decode_scaled_time(type_id, reader.read(size), scale) if size else None
+    if type_id in CHAR_TYPES + NCHAR_TYPES + BINARY_TYPES:
+        max_size = reader.ushort()
+        if type_id not in BINARY_TYPES:
+            reader.read(5)  # collation
+        if max_size == 0xFFFF:
+            data = reader.plp()
+        else:
+            size = reader.ushort()
+            data = None if size == 0xFFFF else reader.read(size)
+        if data is None or type_id in BINARY_TYPES:
+            return data
+        return data.decode('utf-16le' if type_id in NCHAR_TYPES else 'cp1252')
+    raise TDSProtocolError(f"Unsupported RPC parameter type 0x{type_id:02x}")
+
 class TDSProtocolHandler:
-    def parse_query(self, data: bytes) -> str:
+    def parse_query(self, packet_type: int, payload) -> str:
         try:
-            header = struct.unpack('>BBH', data[:4])
-            if header[0] == 0x03:  # SQL Batch
-                return data[8:].decode('utf-16le').strip()
+            if packet_type == SQL_BATCH:
+                offset = self._all_headers_length(payload)
+                return str(payload[offset:], 'utf-16le').strip()
             return ""
-        except Exception as e:
+        except UnicodeDecodeError as e:
             logger.error(f"Protocol error: {str(e)}")
-            raise
+            raise TDSProtocolError(f"Malformed SQL batch: {str(e)}")
 
-    def build_response(self, result) -> bytes:
-        if isinstance(result, list):
-            response = str(result).encode()
-        else:
-            response = str(result).encode()
-        
-        header = struct.pack('>BBHII', 
-            0x04,  # Packet type
-            0x01,  # Status
-            len(response) + 8,
-            0,  # SPID
-            0   # Packet number
-        )
-        return header + response
+    def parse_login(self, payload) -> Login:
+        """Decode a LOGIN7 message; the password is never decoded"""
+        if len(payload) < LOGIN_FIELDS_OFFSET + 4 * len(LOGIN_FIELDS):
+            raise TDSProtocolError("Truncated LOGIN7 message")
+        _, tds_version, packet_size, _, _, _ = LOGIN_HEADER.unpack_from(payload)
+        fields = {}
+        for index, name in enumerate(LOGIN_FIELDS):
+            offset, length = struct.unpack_from('<HH', payload, LOGIN_FIELDS_OFFSET + 4 * index)
+            if name in ('password', 'extension'):
+                continue
+            if offset + length * 2 > len(payload):
+                raise TDSProtocolError(f"LOGIN7 {name} runs past the message")
+            fields[name] = str(payload[offset:offset + length * 2], 'utf-16le')
+        return Login(tds_version, packet_size, **fields)
+
+    def parse_rpc(self, payload) -> list:
+        """Split an RPC message into its requests and decode their parameters"""
+        try:
+            return self._parse_rpc(payload)
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise TDSProtocolError(f"Malformed RPC request: {str(e)}")
+
+    def _parse_rpc(self, payload) -> list:
+        reader = _PayloadReader(payload, self._all_headers_length(payload))
+        requests = []
+        while reader.remaining() > 0:
+            name_length = reader.ushort()
+            if name_length == 0xFFFF:
+                proc_id = reader.ushort()
+                name = SP_PROC_IDS.get(proc_id, f"proc_{proc_id}")
+            else:
+                name = reader.read(name_length * 2).decode('utf-16le')
+            flags = reader.ushort()
+            params = []
+            while reader.remaining() > 0 and reader.data[reader.pos] not in RPC_BATCH_FLAGS:
+                param_name = reader.b_varchar()
+                status = reader.byte()
+                params.append(RPCParam(param_name, read_typed_value(reader), bool(status & 0x01)))
+            if reader.remaining() > 0:
+                reader.byte()
+            requests.append(RPCRequest(name, flags, params))
+        return requests
+
+    def _all_headers_length(self, payload) -> int:
+        # TDS 7.2+ prefixes batches with an ALL_HEADERS block whose first
+        # DWORD is its own total length; UTF-16 SQL text never looks like that
+        if len(payload) < 4:
+            return 0
+        total = struct.unpack_from('<I', payload)[0]
+        if 4 <= total <= len(payload) and total < 0x10000:
+            return total
+        return 0
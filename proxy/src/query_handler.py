@@ -1,4 +1,72 @@
+import os
+import re
+import json
+import inspect
+import hashlib
+import logging
 import sqlglot
+from collections import namedtuple
+from sqlglot import exp
+from translation_cache import TranslationCache, normalize_sql
+from translation_store import TranslationStore
+from fingerprint import (
+    fingerprint_sql, bind_variables, inline_literals, literal_value, unsafe_positions, split_batch,
+    passthrough_sql
+)
+from metrics import PROXY_METRICS
+
+logger = logging.getLogger("query-handler")
+
+# Literal '%' must be doubled once the statement is run with bound parameters
+_PERCENT = re.compile(r"%(?!\(\w+\)s)")
+
+# Table hints that take locks a replica cannot give
+_LOCKING_HINTS = {"UPDLOCK", "XLOCK", "HOLDLOCK", "SERIALIZABLE", "TABLOCKX"}
+
+# Functions whose result changes between identical executions
+_VOLATILE = (exp.CurrentTimestamp, exp.CurrentDate, exp.CurrentTime, exp.Rand, exp.Uuid)
+
+# passthrough marks statements that skipped sqlglot
+Translation = namedtuple(
+    "Translation", ["sql", "params", "read_only", "tables", "cacheable", "passthrough"], defaults=(False,)
+)
+
+def is_temp_table(table) -> bool:
+    """Whether a table node names a Sybase #temp table"""
+    return isinstance(table.this, exp.Identifier) and bool(table.this.args.get("temporary"))
+
+def is_read_only(expression, safe_functions=frozenset()) -> bool:
+    """Whether a parsed statement only reads, so a replica can serve it.
+
+    Calls to functions sqlglot does not know (user functions, nextval)
+    may write and count as writes unless listed in safe_functions.
+    #temp tables only exist on the session's own backend.
+    """
+    if not isinstance(expression, (exp.Select, exp.SetOperation)):
+        return False
+    if any(is_temp_table(table) for table in expression.find_all(exp.Table)):
+        return False
+    if expression.find(exp.Into, exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Lock):
+        return False
+    for hint in expression.find_all(exp.WithTableHint):
+        if any(node.name.upper() in _LOCKING_HINTS for node in hint.expressions):
+            return False
+    return all(node.name.lower() in safe_functions for node in expression.find_all(exp.Anonymous))
+
+def referenced_tables(expression) -> frozenset:
+    """Lower-cased names of the tables a statement reads or writes,
+    #temp tables with their # so they never match a permanent table"""
+    ctes = {cte.alias.lower() for cte in expression.find_all(exp.CTE)}
+    return frozenset(
+        "#" + table.name.lower() if is_temp_table(table) else table.name.lower()
+        for table in expression.find_all(exp.Table)
+        if table.name and table.name.lower() not in ctes
+    )
+
+def load_dialects():
+    """Import the sqlglot dialects now rather than on the first translation"""
+    for dialect in ("tsql", "postgres"):
+        sqlglot.Dialect.get_or_raise(dialect)
 
 class QueryHandler:
     def __init__(self):
@@ -7,15 +75,149 @@ class QueryHandler:
             'varchar': 'text',
             'money': 'numeric(19,4)'
         }
+        self.cache = TranslationCache(
+            "translation",
+            max_entries=int(os.getenv("TRANSLATION_CACHE_SIZE", 10000)),
+            max_bytes=int(os.getenv("TRANSLATION_CACHE_BYTES", 64 * 1024 * 1024))
+        )
+        # Fingerprint -> placeholder positions that have to stay literal
+        self.shapes = TranslationCache(
+            "fingerprint",
+            max_entries=int(os.getenv("TRANSLATION_CACHE_SIZE", 10000))
+        )
+        self.parameterize = os.getenv("AUTO_PARAMETERIZE", "true").lower() == "true"
+        self.fast_path = os.getenv("TRANSLATION_FAST_PATH", "true").lower() == "true"
+        self.safe_functions = frozenset(
+            name.strip().lower() for name in os.getenv("REPLICA_SAFE_FUNCTIONS", "").split(",") if name.strip()
+        )
+        self.store = TranslationStore()
+
+    def start(self):
+        """Load the dialects and warm the caches from the translation store,
+        so the first requests do not pay for either"""
+        load_dialects()
+        if not self.store.start(self.rules_version()):
+            return
+        for key, value in self.store.load(self.cache.name, self.cache.max_entries):
+            self.cache.put(key, Translation(value[0], None, value[1], frozenset(value[2]), *value[3:]))
+        for key, value in self.store.load(self.shapes.name, self.shapes.max_entries):
+            self.shapes.put(key, frozenset(value))
+        logger.info(
+            f"Loaded {len(self.cache)} translations and {len(self.shapes)} statement shapes "
+            f"from {self.store.path}"
+        )
+
+    def stop(self):
+        # What is still cached was used recently, keep it over older entries
+        self.store.touch(self.cache.name, self.cache.keys())
+        self.store.touch(self.shapes.name, self.shapes.keys())
+        self.store.stop()
+
+    def rules_version(self) -> str:
+        """Everything that decides what a statement translates to: the
+        sqlglot version, the translation code and the settings it reads"""
+        digest = hashlib.sha256()
+        for path in (__file__, inspect.getfile(fingerprint_sql), inspect.getfile(normalize_sql)):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        digest.update(json.dumps([
+            sqlglot.__version__, self.type_mappings, self.fast_path, sorted(self.safe_functions)
+        ]).encode())
+        return digest.hexdigest()
 
-    def translate(self, query: str) -> str:
+    def translate(self, query: str) -> Translation:
+        """Translate T-SQL to PostgreSQL.
+
+        Inline literals are lifted into bound parameters where that is
+        safe, so every statement shape is translated once and PostgreSQL
+        can reuse its plan. params is None for unparameterized statements.
+        """
+        if not self.parameterize:
+            return self._translate(query)
+        fingerprint, literals = fingerprint_sql(query)
+        if not literals:
+            return self._translate(query)
+
+        inline = self.shapes.get(fingerprint)
+        if inline is None:
+            inline = self._unsafe_positions(fingerprint, len(literals))
+            self.shapes.put(fingerprint, inline)
+            self.store.put(self.shapes.name, fingerprint, sorted(inline))
+        if len(inline) == len(literals):
+            return self._translate(query)
+
+        template = self._translate(inline_literals(fingerprint, literals, inline))
+        params = {
+            f"p{i}": literal_value(text)
+            for i, text in enumerate(literals) if i not in inline
+        }
+        return template._replace(sql=_PERCENT.sub("%%", template.sql), params=params)
+
+    def translate_batch(self, batch: str) -> list:
+        """Translate each statement of a T-SQL batch"""
+        return [self.translate(statement) for statement in split_batch(batch)]
+
+    def translate_prepared(self, statement: str, names) -> Translation:
+        """Translate a prepared statement whose @variables become bound parameters"""
+        template = self._translate(bind_variables(statement, set(names)))
+        return template._replace(sql=_PERCENT.sub("%%", template.sql))
+
+    def _translate(self, query: str) -> Translation:
+        key = normalize_sql(query)
+        translated = self.cache.get(key)
+        if translated is None:
+            translated = self._passthrough(query) or self._transpile(query)
+            self.cache.put(key, translated)
+            self.store.put(self.cache.name, key, [
+                translated.sql, translated.read_only, sorted(translated.tables),
+                translated.cacheable, translated.passthrough
+            ])
+        PROXY_METRICS['translations'].labels('fast' if translated.passthrough else 'full').inc()
+        return translated
+
+    def _passthrough(self, query: str):
+        if not self.fast_path:
+            return None
+        passthrough = passthrough_sql(query)
+        if passthrough is None:
+            return None
+        sql, tables, read_only = passthrough
+        # No function calls get through, so nothing volatile either
+        return Translation(sql, None, read_only, tables, read_only and bool(tables), passthrough=True)
+
+    def _transpile(self, query: str) -> Translation:
         try:
-            return sqlglot.transpile(
-                query, 
-                read="tsql", 
-                write="postgres",
-                identify=True,
-                mapping=self.type_mappings
-            )[0]
+            expression = sqlglot.parse(query, read="tsql")[0]
+            read_only = is_read_only(expression, self.safe_functions)
+            tables = referenced_tables(expression)
+            cacheable = read_only and bool(tables) and expression.find(*_VOLATILE) is None
+            sql = expression.transform(self._map_node).sql(
+                dialect="postgres",
+                identify=True
+            )
         except Exception as e:
             raise ValueError(f"Translation error: {str(e)}")
+        return Translation(sql, None, read_only, tables, cacheable)
+
+    def _unsafe_positions(self, fingerprint: str, count: int) -> frozenset:
+        if self.fast_path and passthrough_sql(fingerprint) is not None:
+            # The fast path only accepts literals compared with a column,
+            # listed in VALUES or assigned, where binding is always safe
+            return frozenset()
+        try:
+            expression = sqlglot.parse_one(fingerprint, read="tsql")
+        except Exception:
+            return frozenset(range(count))
+        return unsafe_positions(expression, count)
+
+    def _map_node(self, node):
+        if isinstance(node, exp.DataType):
+            target = self.type_mappings.get(node.this.value.lower())
+            if target:
+                return exp.DataType.build(target, dialect="postgres")
+        elif isinstance(node, exp.Table) and is_temp_table(node):
+            # #name is the session's own temp table, never a permanent
+            # table of the same name; tempdb.. qualifiers go with it
+            node.set("catalog", None)
+            node.set("db", exp.to_identifier("pg_temp"))
+        return node
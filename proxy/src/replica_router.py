@@ -0,0 +1,113 @@
+import os
+import asyncio
+import logging
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from connection_manager import connection_kwargs, configure_connection
+from metrics import PROXY_METRICS
+
+logger = logging.getLogger("replica-router")
+
+# Seconds the replica is behind; zero when it has replayed everything received
+LAG_QUERY = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+class Replica:
+    def __init__(self, address):
+        host, _, port = address.strip().partition(":")
+        self.name = address.strip()
+        self.pool = AsyncConnectionPool(
+            kwargs=connection_kwargs(host, port or None),
+            min_size=int(os.getenv("PG_REPLICA_MIN_CONN", 2)),
+            max_size=int(os.getenv("PG_REPLICA_MAX_CONN", 20)),
+            configure=configure_connection,
+            # Short, a read waiting on a busy replica is better off on the primary
+            timeout=float(os.getenv("PG_REPLICA_POOL_TIMEOUT", 1)),
+            max_lifetime=float(os.getenv("PG_MAX_LIFETIME", 3600)),
+            name=f"replica-{self.name}",
+            open=False
+        )
+        self.lag = None
+
+class ReplicaRouter:
+    """Sends read-only statements to streaming replicas from PG_REPLICA_HOSTS.
+
+    Replica lag is polled every REPLICA_LAG_CHECK_INTERVAL seconds; a
+    replica further behind than MAX_REPLICA_LAG seconds, or one that cannot
+    be reached, gets no reads until it catches up.
+    """
+
+    def __init__(self):
+        hosts = [host for host in os.getenv("PG_REPLICA_HOSTS", "").split(",") if host.strip()]
+        self.replicas = [Replica(host) for host in hosts]
+        self.max_lag = float(os.getenv("MAX_REPLICA_LAG", 5))
+        self.check_interval = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", 2))
+        self._owners = {}
+        self._next = 0
+        self._monitor = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    async def open(self):
+        if not self.replicas:
+            return
+        for replica in self.replicas:
+            await replica.pool.open()
+        await self._check_lag()
+        self._monitor = asyncio.create_task(self._watch_lag())
+
+    async def close(self):
+        if self._monitor:
+            self._monitor.cancel()
+            self._monitor = None
+        for replica in self.replicas:
+            await replica.pool.close()
+
+    async def get_conn(self):
+        """A connection to a replica within the lag threshold, or None when
+        every such replica's pool stayed exhausted for PG_REPLICA_POOL_TIMEOUT"""
+        count = len(self.replicas)
+        for offset in range(count):
+            replica = self.replicas[(self._next + offset) % count]
+            if replica.lag is None or replica.lag > self.max_lag:
+                continue
+            self._next = (self._next + offset + 1) % count
+            try:
+                conn = await replica.pool.getconn()
+            except PoolTimeout:
+                PROXY_METRICS['replica_pool_timeouts'].labels(replica.name).inc()
+                continue
+            self._owners[conn] = replica
+            return conn
+        return None
+
+    def owns(self, conn) -> bool:
+        return conn in self._owners
+
+    async def put_conn(self, conn):
+        replica = self._owners.pop(conn)
+        await replica.pool.putconn(conn)
+
+    async def _watch_lag(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self._check_lag()
+
+    async def _check_lag(self):
+        for replica in self.replicas:
+            try:
+                async with replica.pool.connection(timeout=self.check_interval) as conn:
+                    cursor = await conn.execute(LAG_QUERY)
+                    replica.lag = float((await cursor.fetchone())[0])
+            except Exception as e:
+                if replica.lag is not None:
+                    logger.warning(f"Replica {replica.name} unavailable: {str(e)}")
+                replica.lag = None
+            PROXY_METRICS['replica_lag'].labels(replica.name).set(
+                replica.lag if replica.lag is not None else float("inf")
+            )
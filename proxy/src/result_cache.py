@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+import logging
+import psycopg
+from collections import OrderedDict
+from connection_manager import connection_kwargs
+from metrics import PROXY_METRICS
+
+logger = logging.getLogger("result-cache")
+
+# NOTIFY channel carrying comma-separated table names between workers
+CHANNEL = "proxy_result_cache"
+
+class CachedResult:
+    def __init__(self, payload, row_count, tables, expires):
+        self.payload = payload
+        self.row_count = row_count
+        self.tables = tables
+        self.expires = expires
+
+class ResultCache:
+    """Encoded results of SELECTs over the tables in RESULT_CACHE_TABLES.
+
+    Entries hold the COLMETADATA and ROW tokens exactly as sent, so a hit
+    is copied straight into the reply. They expire after RESULT_CACHE_TTL
+    seconds, are evicted least recently used past RESULT_CACHE_BYTES, and
+    are dropped when a write through any worker touches one of their
+    tables: writers NOTIFY the change and every worker LISTENs for it.
+    Only used from the event loop thread.
+    """
+
+    def __init__(self):
+        self.tables = frozenset(
+            name.strip().lower() for name in os.getenv("RESULT_CACHE_TABLES", "").split(",") if name.strip()
+        )
+        self.ttl = float(os.getenv("RESULT_CACHE_TTL", 30))
+        self.max_bytes = int(os.getenv("RESULT_CACHE_BYTES", 64 * 1024 * 1024))
+        self.max_entry_bytes = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+        self.size = 0
+        # Bumped by every invalidation, so results read before a write
+        # that lands mid-query are not stored
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self._listener = None
+        self.listening = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.tables) and self.max_bytes > 0
+
+    def covers(self, translation) -> bool:
+        # Without the listener other workers' writes would go unnoticed
+        return self.listening and translation.cacheable and translation.tables <= self.tables
+
+    def watches(self, tables) -> bool:
+        return self.enabled and not self.tables.isdisjoint(tables)
+
+    def key(self, sql, params):
+        if params is None:
+            return sql, None
+        items = tuple(params.items()) if isinstance(params, dict) else tuple(params)
+        try:
+            hash(items)
+        except TypeError:
+            return None
+        return sql, items
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry.expires < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            PROXY_METRICS['result_cache_misses'].inc()
+            return None
+        self._entries.move_to_end(key)
+        PROXY_METRICS['result_cache_hits'].inc()
+        return entry
+
+    def put(self, key, payload, row_count, tables, generation):
+        if generation != self.generation or len(payload) > self.max_entry_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = CachedResult(payload, row_count, tables, time.monotonic() + self.ttl)
+        self.size += len(payload)
+        for table in tables:
+            self._by_table.setdefault(table, set()).add(key)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        PROXY_METRICS['result_cache_bytes'].set(self.size)
+
+    def invalidate(self, tables):
+        self.generation += 1
+        dropped = 0
+        for table in tables:
+            for key in list(self._by_table.get(table, ())):
+                self._remove(key)
+                dropped += 1
+        if dropped:
+            PROXY_METRICS['result_cache_invalidations'].inc(dropped)
+            PROXY_METRICS['result_cache_bytes'].set(self.size)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self._by_table.clear()
+        self.size = 0
+        PROXY_METRICS['result_cache_bytes'].set(0)
+
+    async def notify(self, conn, tables):
+        """Invalidate locally and tell the other workers once conn commits"""
+        watched = sorted(self.tables.intersection(tables))
+        self.invalidate(watched)
+        await conn.execute("SELECT pg_notify(%s, %s)", (CHANNEL, ",".join(watched)))
+
+    async def open(self):
+        if self.enabled:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        self.listening = False
+        if self._listener:
+            self._listener.cancel()
+            self._listener = None
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry.payload)
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    async def _listen(self):
+        while True:
+            try:
+                conn = await psycopg.AsyncConnection.connect(**connection_kwargs(os.getenv("PG_HOST")))
+                async with conn:
+                    await conn.execute(f"LISTEN {CHANNEL}")
+                    # Changes made while we were not listening are unknown
+                    self.clear()
+                    self.listening = True
+                    async for notify in conn.notifies():
+                        self.invalidate(notify.payload.split(","))
+            except psycopg.Error as e:
+                logger.error(f"Result cache listener failed: {str(e)}")
+                self.listening = False
+                self.clear()
+                await asyncio.sleep(1)
@@ -0,0 +1,301 @@
+import os
+import re
+import time
+import asyncio
+import weakref
+import logging
+from psycopg.pq import TransactionStatus
+from metrics import PROXY_METRICS
+
+logger = logging.getLogger("session-backend")
+
+# Session state a released backend must not carry over to the next client
+DEFAULT_RESET_QUERY = (
+    "CLOSE ALL; UNLISTEN *; SELECT pg_advisory_unlock_all(); DISCARD TEMP; DISCARD SEQUENCES"
+)
+
+CREATE_TEMP = re.compile(r"^\s*CREATE\s+(?:GLOBAL\s+|LOCAL\s+)?TEMP(?:ORARY)?\s+TABLE\b", re.IGNORECASE)
+SELECT_INTO_TEMP = re.compile(r"^\s*SELECT\b.*\bINTO\s+TEMP(?:ORARY)?\b", re.IGNORECASE | re.DOTALL)
+DROP_TABLE = re.compile(r"^\s*DROP\s+TABLE\b", re.IGNORECASE)
+# Statements that can make an existing table bigger
+GROWS_TABLE = re.compile(r"^\s*(?:INSERT|UPDATE|MERGE)\b", re.IGNORECASE)
+# How translated SQL names a #temp table
+TEMP_REFERENCE = '"pg_temp".'
+SET_PARAMETER = re.compile(
+    r"^\s*SET\s+(?:SESSION\s+)?(?!LOCAL\b|TRANSACTION\b|CONSTRAINTS\b)(\"?[\w.]+\"?)", re.IGNORECASE
+)
+RESET_PARAMETER = re.compile(r"^\s*RESET\s+(\"?[\w.]+\"?)", re.IGNORECASE)
+
+# Session SET statements last applied to each pooled backend
+_applied_settings = weakref.WeakKeyDictionary()
+
+_SIZE = re.compile(r"^\s*(\d+)\s*([kmgt]?)b?\s*$", re.IGNORECASE)
+_SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+def parse_size(text) -> int:
+    """Bytes in a PostgreSQL style size such as 100MB, 64kB or 8192"""
+    match = _SIZE.match(text)
+    if not match:
+        raise ValueError(f"Invalid size: {text}")
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).lower()]
+
+class TempTableFullError(Exception):
+    """Raised for a write to a #temp table already over MAX_TEMP_TABLE_SIZE"""
+    pass
+
+class SessionBackend:
+    """Backend checkout for one client session in transaction pooling mode.
+
+    Statements borrow a pooled connection and hand it straight back unless
+    they leave state behind on it: an open transaction, a temp table or an
+    open cursor. The connection is then pinned to the session until that
+    state is gone, and cleaned with PG_RESET_QUERY before it goes back to
+    the pool. SET statements are remembered and replayed on whichever
+    backend the session borrows next.
+
+    Read-only statements outside a pin go to a replica when one is within
+    the lag threshold, except right after the session wrote, so it reads
+    its own writes.
+
+    #temp tables are PostgreSQL temp tables on the pinned backend. Their
+    sizes are read back at most every TEMP_TABLE_CHECK_INTERVAL seconds
+    while the session writes to them, and statements that would grow one
+    already over MAX_TEMP_TABLE_SIZE are refused.
+    """
+
+    def __init__(self, connections, replicas):
+        self.connections = connections
+        self.replicas = replicas
+        self.reset_query = os.getenv("PG_RESET_QUERY", DEFAULT_RESET_QUERY)
+        self.conn = None
+        # Connection running the session's current statement
+        self.active = None
+        self._cancel_lock = asyncio.Lock()
+        self.pins = set()
+        self.max_temp_size = parse_size(os.getenv("MAX_TEMP_TABLE_SIZE", "100MB"))
+        self.temp_check_interval = float(os.getenv("TEMP_TABLE_CHECK_INTERVAL", 1.0))
+        # Temp table name -> bytes when last checked
+        self.temp_tables = {}
+        self.temp_checked = float("-inf")
+        self.settings = {}
+        self.last_write = float("-inf")
+
+    async def acquire(self, read_only=False):
+        if self.conn is not None:
+            self.active = self.conn
+            return self.conn
+        conn = None
+        if read_only and self.replicas.enabled:
+            if time.monotonic() - self.last_write > self.replicas.max_lag:
+                conn = await self.replicas.get_conn()
+            PROXY_METRICS['routed_statements'].labels('primary' if conn is None else 'replica').inc()
+        if conn is None:
+            conn = await self.connections.get_conn()
+        try:
+            await self._apply_settings(conn)
+        except BaseException:
+            await self._put(conn)
+            raise
+        self.active = conn
+        return conn
+
+    async def release(self, conn, statements=(), read_only=False):
+        """Hand conn back after statements ran, unless it now holds session state.
+
+        statements is the SQL that ran successfully on conn.
+        """
+        if conn is self.active:
+            self.active = None
+        if self._cancel_lock.locked():
+            # A cancel request for conn must land before anyone else gets it
+            async with self._cancel_lock:
+                pass
+        if self.replicas.owns(conn):
+            await self.replicas.put_conn(conn)
+            return
+        if statements and not read_only:
+            self.last_write = time.monotonic()
+        status = conn.info.transaction_status
+        if conn.closed or status == TransactionStatus.UNKNOWN:
+            # Whatever the session kept on this backend went with it
+            if conn is self.conn:
+                logger.warning("Pinned backend connection lost")
+                self._set_pinned(None)
+                self.pins.clear()
+                self.temp_tables.clear()
+            await self.connections.put_conn(conn)
+            return
+
+        ended = "transaction" in self.pins and status == TransactionStatus.IDLE
+        if status == TransactionStatus.IDLE:
+            self.pins.discard("transaction")
+        else:
+            self.pins.add("transaction")
+
+        for statement in statements:
+            self._track_settings(statement)
+        creates = any(CREATE_TEMP.match(statement) or SELECT_INTO_TEMP.match(statement) for statement in statements)
+        drops = self.temp_tables and (ended or any(DROP_TABLE.match(statement) for statement in statements))
+        # Writes into temp tables are checked against the size cap now and
+        # then, and anything touching a full one may have shrunk it
+        touched = [statement for statement in statements if TEMP_REFERENCE in statement]
+        resized = self.temp_tables and touched and (
+            self._temp_full()
+            or (any(GROWS_TABLE.match(statement) for statement in touched)
+                and time.monotonic() - self.temp_checked >= self.temp_check_interval)
+        )
+        if (creates or drops or resized) and status != TransactionStatus.INERROR:
+            await self._refresh_temp_tables(conn)
+        _applied_settings[conn] = tuple(self.settings.values())
+
+        if self.temp_tables:
+            self.pins.add("temp")
+        else:
+            self.pins.discard("temp")
+
+        if self.pins:
+            self._set_pinned(conn)
+            return
+        if conn is self.conn:
+            self._set_pinned(None)
+            await self._reset(conn)
+        await self.connections.put_conn(conn)
+
+    def check_temp_writes(self, translations):
+        """Refuse statements that would grow a temp table over the size cap"""
+        if not self._temp_full():
+            return
+        for translation in translations:
+            if not GROWS_TABLE.match(translation.sql):
+                continue
+            for name in translation.tables:
+                size = self.temp_tables.get(name[1:], 0) if name.startswith("#") else 0
+                if size > self.max_temp_size:
+                    PROXY_METRICS['temp_tables_full'].inc()
+                    raise TempTableFullError(
+                        f"Temp table {name} holds {size} bytes, over MAX_TEMP_TABLE_SIZE of {self.max_temp_size}"
+                    )
+
+    def _temp_full(self) -> bool:
+        return self.max_temp_size > 0 and any(size > self.max_temp_size for size in self.temp_tables.values())
+
+    @property
+    def in_transaction(self) -> bool:
+        """Whether the client has a transaction open on the pinned connection"""
+        return "transaction" in self.pins
+
+    async def pin(self, reason):
+        """Return a connection that stays with the session until unpin(reason)"""
+        conn = await self.acquire()
+        self.pins.add(reason)
+        self._set_pinned(conn)
+        return conn
+
+    async def checkout(self):
+        """A connection with the session's settings that transaction pooling
+        leaves alone until checkin(), for work beside the session's own"""
+        conn = await self.connections.get_conn()
+        try:
+            await self._apply_settings(conn)
+        except BaseException:
+            await self.connections.put_conn(conn)
+            raise
+        return conn
+
+    async def checkin(self, conn):
+        if not conn.closed and conn.info.transaction_status != TransactionStatus.IDLE:
+            try:
+                await conn.rollback()
+            except Exception as e:
+                logger.error(f"Rolling back a checked out connection failed: {str(e)}")
+        await self.connections.put_conn(conn)
+
+    async def unpin(self, reason):
+        self.pins.discard(reason)
+        if self.conn is not None:
+            await self.release(self.conn)
+
+    async def cancel(self) -> bool:
+        """Ask PostgreSQL to cancel whatever the session's backend is running"""
+        async with self._cancel_lock:
+            conn = self.active or self.conn
+            if conn is None or conn.closed:
+                return False
+            try:
+                if hasattr(conn, "cancel_safe"):
+                    await conn.cancel_safe()
+                else:
+                    # psycopg before 3.2 only has the blocking call
+                    await asyncio.get_running_loop().run_in_executor(None, conn.cancel)
+            except Exception as e:
+                logger.error(f"Cancel request failed: {str(e)}")
+                return False
+        return True
+
+    async def close(self):
+        conn = self.conn
+        self.active = None
+        self._set_pinned(None)
+        self.pins.clear()
+        self.temp_tables.clear()
+        if conn is None:
+            return
+        try:
+            if conn.info.transaction_status != TransactionStatus.IDLE:
+                await conn.rollback()
+            await self._reset(conn)
+        finally:
+            await self.connections.put_conn(conn)
+
+    async def _put(self, conn):
+        if self.replicas.owns(conn):
+            await self.replicas.put_conn(conn)
+        else:
+            await self.connections.put_conn(conn)
+
+    def _set_pinned(self, conn):
+        if (conn is None) != (self.conn is None):
+            PROXY_METRICS['pinned_sessions'].inc(1 if conn is not None else -1)
+        self.conn = conn
+
+    def _track_settings(self, statement):
+        match = SET_PARAMETER.match(statement)
+        if match:
+            self.settings[match.group(1).strip('"').lower()] = statement.strip().rstrip(";")
+            return
+        match = RESET_PARAMETER.match(statement)
+        if match:
+            name = match.group(1).strip('"').lower()
+            if name == "all":
+                self.settings.clear()
+            else:
+                self.settings.pop(name, None)
+
+    async def _apply_settings(self, conn):
+        wanted = tuple(self.settings.values())
+        if _applied_settings.get(conn, ()) == wanted:
+            return
+        await conn.execute("; ".join(("RESET ALL",) + wanted))
+        _applied_settings[conn] = wanted
+
+    async def _refresh_temp_tables(self, conn):
+        # Dropped, rolled back or ON COMMIT DROP tables all leave the catalog
+        try:
+            cursor = await conn.execute(
+                "SELECT relname, pg_total_relation_size(oid) FROM pg_class "
+                "WHERE relnamespace = pg_my_temp_schema() AND relkind IN ('r', 'p')"
+            )
+            self.temp_tables = {row[0].lower(): row[1] for row in await cursor.fetchall()}
+            self.temp_checked = time.monotonic()
+        except Exception as e:
+            # Stay pinned rather than risk handing temp tables to another client
+            logger.error(f"Temp table lookup failed: {str(e)}")
+            self.temp_tables[None] = 0
+
+    async def _reset(self, conn):
+        try:
+            await conn.execute(self.reset_query)
+        except Exception as e:
+            # Closed connections are discarded by the pool instead of reused
+            logger.error(f"Backend reset failed: {str(e)}")
+            await conn.close()
@@ -0,0 +1,139 @@
+import os
+import json
+import queue
+import random
+import asyncio
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+logger = logging.getLogger("slow-query-log")
+
+class RequestTrace:
+    """Source T-SQL and the statements one client request turned into"""
+    __slots__ = ("source", "statements")
+
+    def __init__(self):
+        self.source = []
+        self.statements = []
+
+    def add(self, translation, params, rows):
+        self.statements.append((translation, params, rows))
+
+class SlowQueryLog:
+    """JSON lines for requests over SLOW_QUERY_THRESHOLD seconds in total,
+    or over a per-phase limit from SLOW_QUERY_PHASE_THRESHOLDS
+    ("translate=0.05,pool_wait=0.2").
+
+    Records go through a queue to a thread that owns the rotating file,
+    so request handling never waits on disk. SLOW_QUERY_EXPLAIN_SAMPLE of
+    slow read-only statements are re-run under EXPLAIN (ANALYZE, BUFFERS)
+    in the background, inside a rolled back transaction, and the plan is
+    added to the record.
+    """
+
+    def __init__(self, connections):
+        self.connections = connections
+        self.path = os.getenv("SLOW_QUERY_LOG", "").replace("{pid}", str(os.getpid()))
+        self.threshold = float(os.getenv("SLOW_QUERY_THRESHOLD", 1.0))
+        self.phase_thresholds = {}
+        for item in os.getenv("SLOW_QUERY_PHASE_THRESHOLDS", "").split(","):
+            phase, _, limit = item.partition("=")
+            if limit:
+                self.phase_thresholds[phase.strip()] = float(limit)
+        self.redact = os.getenv("SLOW_QUERY_REDACT_PARAMS", "true").lower() == "true"
+        self.explain_sample = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", 0))
+        self._log = logging.getLogger("slow-query-records")
+        self._log.propagate = False
+        self._listener = None
+        self._explaining = False
+        self._tasks = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def start(self):
+        if not self.enabled or self._listener:
+            return
+        records = queue.SimpleQueue()
+        handler = RotatingFileHandler(
+            self.path,
+            maxBytes=int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", 100 * 1024 * 1024)),
+            backupCount=int(os.getenv("SLOW_QUERY_LOG_BACKUPS", 5)),
+            encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._log.addHandler(QueueHandler(records))
+        self._log.setLevel(logging.INFO)
+        self._listener = QueueListener(records, handler)
+        self._listener.start()
+        logger.info(f"Logging slow queries to {self.path}")
+
+    def stop(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+
+    def is_slow(self, timer) -> bool:
+        if timer.total >= self.threshold:
+            return True
+        return any(timer.phases.get(phase, 0.0) >= limit for phase, limit in self.phase_thresholds.items())
+
+    def record(self, timer, trace, client=None):
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "client": client,
+            "statement_type": timer.statement_type,
+            "total": round(timer.total, 6),
+            "phases": {phase: round(seconds, 6) for phase, seconds in timer.phases.items()},
+            "source": trace.source,
+            "statements": [
+                {"sql": translation.sql, "params": self._params(params), "rows": rows}
+                for translation, params, rows in trace.statements
+            ],
+        }
+        candidates = [(t, p) for t, p, _ in trace.statements if t.read_only]
+        if candidates and not self._explaining and random.random() < self.explain_sample:
+            self._explaining = True
+            task = asyncio.create_task(self._explain(entry, *candidates[0]))
+            self._tasks.add(task)
+            task.add_done_callback(self._explained)
+            return
+        self._write(entry)
+
+    def _explained(self, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            self._explaining = False
+        elif task.exception():
+            logger.error(f"Error explaining slow query: {str(task.exception())}")
+
+    def _write(self, entry):
+        self._log.info(json.dumps(entry, default=str))
+
+    def _params(self, params):
+        if params is None:
+            return None
+        if isinstance(params, dict):
+            items = params.items()
+        else:
+            items = enumerate(params)
+        if self.redact:
+            return {str(name): type(value).__name__ for name, value in items}
+        return {str(name): value for name, value in items}
+
+    async def _explain(self, entry, translation, params):
+        try:
+            conn = await self.connections.get_conn()
+            try:
+                async with conn.transaction(force_rollback=True):
+                    cursor = await conn.execute(f"EXPLAIN (ANALYZE, BUFFERS) {translation.sql}", params)
+                    entry["plan"] = "\n".join(row[0] for row in await cursor.fetchall())
+            finally:
+                await self.connections.put_conn(conn)
+        except Exception as e:
+            entry["plan_error"] = str(e)
+        finally:
+            self._explaining = False
+            self._write(entry)
@@ -0,0 +1,154 @@
+import time
+# Taken before the imports below so the startup report includes them
+STARTED = time.perf_counter()
+
+import os
+import socket
+import signal
+import tempfile
+import glob
+import logging
+
+# prometheus_client picks its value backend at import time, so the shared
+# metrics directory has to exist before anything imports it
+if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="proxy-metrics-")
+
+from prometheus_client import CollectorRegistry, start_http_server
+from prometheus_client import multiprocess
+from main import ProxyServer, create_listener
+from metrics import StartupTimer
+from query_handler import load_dialects
+
+logger = logging.getLogger("proxy-supervisor")
+
+class Supervisor:
+    def __init__(self, startup=None):
+        self.startup = startup or StartupTimer()
+        self.host = os.getenv("PROXY_HOST", "0.0.0.0")
+        self.port = int(os.getenv("PROXY_PORT", 5000))
+        self.backlog = int(os.getenv("LISTEN_BACKLOG", socket.SOMAXCONN))
+        self.num_workers = int(os.getenv("PROXY_WORKERS", os.cpu_count() or 1))
+        self.reuse_port = (
+            hasattr(socket, "SO_REUSEPORT")
+            and os.getenv("PROXY_REUSE_PORT", "true").lower() == "true"
+        )
+        self.metrics_port = int(os.getenv("METRICS_PORT", 9100))
+        self.restart_delay = float(os.getenv("WORKER_RESTART_DELAY", 1))
+        self.metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+        self.sock = None
+        self.generation = 0
+        self.workers = {}  # pid -> (slot, generation)
+        self.reload_requested = False
+        self.stopping = False
+
+    def run(self):
+        for path in glob.glob(os.path.join(self.metrics_dir, "*.db")):
+            os.remove(path)
+
+        if not self.reuse_port:
+            # Bind once and let every worker inherit the listening fd
+            self.sock = create_listener(self.host, self.port, self.backlog)
+
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        self.startup.mark("listen")
+        # Loaded once here, workers share the pages after the fork
+        load_dialects()
+        self.startup.mark("dialects")
+        for slot in range(self.num_workers):
+            self._spawn(slot)
+        self.startup.mark("fork")
+        self._start_metrics()
+        self.startup.mark("metrics")
+        logger.info(
+            f"Supervisor {os.getpid()} started {self.num_workers} workers on "
+            f"{self.host}:{self.port} ({'SO_REUSEPORT' if self.reuse_port else 'shared fd'})"
+        )
+        # Workers report their own startup once they listen
+        self.startup.report(logger)
+
+        while self.workers or not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self._reload()
+            self._reap()
+            time.sleep(0.2)
+
+        if self.sock:
+            self.sock.close()
+        logger.info("All workers exited, supervisor shutting down")
+
+    def _start_metrics(self):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(self.metrics_port, registry=registry)
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            os._exit(self._run_worker(slot))
+        self.workers[pid] = (slot, self.generation)
+        logger.info(f"Started worker {slot} (pid {pid}, generation {self.generation})")
+
+    def _run_worker(self, slot):
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        try:
+            ProxyServer().start(sock=self.sock, reuse_port=self.reuse_port)
+            return 0
+        except Exception as e:
+            logger.error(f"Worker {slot} failed: {str(e)}")
+            return 1
+
+    def _reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            slot, generation = self.workers.pop(pid, (None, None))
+            if slot is None:
+                continue
+            multiprocess.mark_process_dead(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping or generation != self.generation:
+                logger.info(f"Worker {slot} (pid {pid}) exited with {code}")
+                continue
+            logger.warning(f"Worker {slot} (pid {pid}) died with {code}, restarting")
+            time.sleep(self.restart_delay)
+            self._spawn(slot)
+
+    def _reload(self):
+        old = list(self.workers)
+        self.generation += 1
+        logger.info(f"Reloading: starting generation {self.generation}, draining {len(old)} workers")
+        for slot in range(self.num_workers):
+            self._spawn(slot)
+        self._signal(old, signal.SIGTERM)
+
+    def _signal(self, pids, sig):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def _on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _on_stop(self, signum, frame):
+        if not self.stopping:
+            self.stopping = True
+            self._signal(list(self.workers), signal.SIGTERM)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    startup = StartupTimer(STARTED)
+    startup.mark("imports")
+    Supervisor(startup).run()
@@ -1,48 +1,151 @@
+import re
 import sqlglot
 from sqlglot import exp
 
+# Node type -> rules, in registration order
+RULES = {}
+
+# RAISERROR format specifications; PL/pgSQL RAISE only knows %
+_FORMAT_SPEC = re.compile(r"%[-+ 0#]*(?:\d+|\*)?(?:\.(?:\d+|\*))?(?:h|l|I64)?[dioxXusc]")
+_DECLARE_CURSOR = re.compile(r"^\s*(\w+)\s+(?:\w+\s+)*?CURSOR\b(?:\s+\w+)*?\s+FOR\s+(.+)$", re.IGNORECASE | re.DOTALL)
+_CURSOR_OPTIONS = re.compile(r"\bFOR\s+(?:READ\s+ONLY|UPDATE(?:\s+OF\s+.+)?)\s*$", re.IGNORECASE | re.DOTALL)
+
+def rule(*node_types):
+    """Register a conversion rule for the given sqlglot node types.
+
+    A rule is called as rule(converter, node). It may change node in place
+    and return it, in which case the walk goes on into its children, or
+    return a replacement, whose children it must have converted itself.
+    """
+    def register(func):
+        for node_type in node_types:
+            RULES.setdefault(node_type, []).append(func)
+        SybaseConverter._dispatch.clear()
+        return func
+    return register
+
 class SybaseConverter:
+    """T-SQL to PostgreSQL with Sybase-specific rewrites.
+
+    Each statement is parsed once and walked once; every node is looked up
+    by type in RULES, so adding a rule costs nothing for nodes it does not
+    handle and no subtree is turned back into SQL until the end.
+    """
+    # Node type -> rules for it and its base classes
+    _dispatch = {}
+
     def convert(self, sql: str) -> str:
-        return sqlglot.transpile(sql, read="tsql", write="postgres", transforms={
-            self._convert_raiserror,
-            self._convert_temp_tables,
-            self._convert_cursors,
-            self._convert_xml
-        })[0]
-
-    def _convert_raiserror(self, expression):
-        if isinstance(expression, exp.RaiseError):
-            return exp.Raise(
-                level='EXCEPTION',
-                message=expression.args.get("msg")
-            )
-        return expression
-
-    def _convert_temp_tables(self, expression):
-        if isinstance(expression, exp.Create) and expression.args["this"].name.startswith("#"):
-            return expression.this.set("temporary", True)
-        return expression
-
-    def _convert_cursors(self, expression):
-        if isinstance(expression, exp.DeclareCursor):
-            return exp.Declare(
-                cursor=expression.args["cursor"],
-                query=expression.args["query"]
-            )
-        return expression
-
-    def _convert_xml(self, expression):
-        if "FOR XML" in expression.sql():
-            return exp.Tag(
-                this=exp.Identifier(this="XMLAGG"),
-                expressions=[
-                    exp.Tag(
-                        this=exp.Identifier(this="XMLELEMENT"),
-                        expressions=[
-                            exp.Identifier(this="row"),
-                            expression.args["expressions"]
-                        ]
-                    )
-                ]
-            )
-        return expression
\ No newline at end of file
+        statements = [
+            self.transform(expression).sql(dialect="postgres")
+            for expression in sqlglot.parse(sql, read="tsql") if expression is not None
+        ]
+        return ";\n".join(statements)
+
+    def transform(self, expression):
+        return expression.transform(self._apply, copy=False)
+
+    def _apply(self, node):
+        for func in self._rules_for(type(node)):
+            replacement = func(self, node)
+            if replacement is not node:
+                return replacement
+        return node
+
+    def _rules_for(self, node_type):
+        rules = self._dispatch.get(node_type)
+        if rules is None:
+            rules = [func for klass in node_type.__mro__ for func in RULES.get(klass, ())]
+            self._dispatch[node_type] = rules
+        return rules
+
+@rule(exp.Anonymous)
+def convert_raiserror(converter, node):
+    # RAISERROR (message, severity, state [, argument ...])
+    if node.name.upper() != "RAISERROR" or len(node.expressions) < 3:
+        return node
+    message, severity, _, *arguments = node.expressions
+    level = "EXCEPTION"
+    if severity.is_int and int(severity.name) <= 10:
+        # Severity 10 and below is informational in Sybase
+        level = "NOTICE"
+    if message.is_string:
+        template = exp.Literal.string(_FORMAT_SPEC.sub("%", message.name))
+    else:
+        template, arguments = exp.Literal.string("%"), [message]
+    parts = [template.sql(dialect="postgres")]
+    parts += [converter.transform(argument).sql(dialect="postgres") for argument in arguments]
+    return exp.Command(this="RAISE", expression=exp.Literal.string(f"{level} {', '.join(parts)}"))
+
+@rule(exp.Create)
+def convert_temp_table(converter, node):
+    table = node.find(exp.Table)
+    identifier = table.this if table is not None else None
+    if not isinstance(identifier, exp.Identifier):
+        return node
+    if identifier.name.startswith("#"):
+        # Older sqlglot keeps the # in the name
+        identifier.set("this", identifier.name.lstrip("#"))
+        identifier.set("temporary", True)
+    # An index or view on a #temp table only loses the #, the temp schema
+    # comes first on the search path
+    if str(node.kind).upper() != "TABLE":
+        identifier.set("temporary", None)
+        return node
+    if identifier.args.get("temporary") and not node.find(exp.TemporaryProperty):
+        properties = node.args.get("properties") or exp.Properties(expressions=[])
+        properties.append("expressions", exp.TemporaryProperty())
+        node.set("properties", properties)
+    return node
+
+@rule(exp.Command)
+def convert_cursor(converter, node):
+    if node.name.upper() != "DECLARE":
+        return node
+    text = node.expression.name if isinstance(node.expression, exp.Literal) else str(node.expression or "")
+    match = _DECLARE_CURSOR.match(text)
+    if not match:
+        return node
+    # Sybase FOR READ ONLY / FOR UPDATE clauses have no PostgreSQL cursor form
+    query = _CURSOR_OPTIONS.sub("", match.group(2)).strip()
+    try:
+        select = sqlglot.parse_one(query, read="tsql")
+    except sqlglot.errors.ParseError:
+        return node
+    converted = converter.transform(select).sql(dialect="postgres")
+    return exp.Command(this="DECLARE", expression=exp.Literal.string(f"{match.group(1)} CURSOR FOR {converted}"))
+
+@rule(exp.Select)
+def convert_for_xml(converter, node):
+    clause = node.args.get("for_")
+    if clause is None or str(clause.args.get("kind", "")).upper() != "XML":
+        return node
+    mode, root = None, None
+    for option in clause.expressions:
+        value = option.this
+        if isinstance(value, exp.XMLKeyValueOption):
+            key = value.this.name.upper()
+            if key == "ROOT":
+                root = value.expression.name if value.expression else "root"
+            elif key in ("PATH", "RAW"):
+                mode = value.expression.name if value.expression else "row"
+        elif value.name.upper() == "AUTO":
+            table = node.find(exp.Table)
+            mode = table.name if table is not None else "row"
+        elif value.name.upper() in ("PATH", "RAW"):
+            mode = "row"
+    # One element per row holding a child element per column, aggregated
+    # into a single value like FOR XML returns
+    element = exp.XMLElement(
+        this=exp.to_identifier(mode or "row"),
+        expressions=[exp.Anonymous(this="XMLFOREST", expressions=node.expressions)]
+    )
+    order = node.args.get("order")
+    if order is not None:
+        element = exp.Order(this=element, expressions=order.expressions)
+    aggregate = exp.Anonymous(this="XMLAGG", expressions=[element])
+    if root:
+        aggregate = exp.XMLElement(this=exp.to_identifier(root), expressions=[aggregate])
+    node.set("for_", None)
+    node.set("order", None)
+    node.set("expressions", [aggregate])
+    return node
@@ -0,0 +1,217 @@
+import struct
+from functools import lru_cache
+
+# Token types
+RETURNSTATUS = 0x79
+COLMETADATA = 0x81
+ERROR = 0xAA
+RETURNVALUE = 0xAC
+LOGINACK = 0xAD
+ROW = 0xD1
+DONE = 0xFD
+DONEPROC = 0xFE
+DONEINPROC = 0xFF
+ENVCHANGE = 0xE3
+
+# ENVCHANGE types
+ENV_DATABASE = 1
+ENV_PACKET_SIZE = 4
+
+# PRELOGIN options
+PRELOGIN_VERSION = 0x00
+PRELOGIN_ENCRYPTION = 0x01
+PRELOGIN_INSTOPT = 0x02
+PRELOGIN_THREADID = 0x03
+PRELOGIN_MARS = 0x04
+PRELOGIN_TERMINATOR = 0xFF
+ENCRYPT_NOT_SUP = 0x02
+
+SERVER_NAME = "sybase-proxy"
+SERVER_VERSION = (1, 0, 0, 0)
+
+# DONE status bits
+DONE_FINAL = 0x0000
+DONE_MORE = 0x0001
+DONE_ERROR = 0x0002
+DONE_COUNT = 0x0010
+DONE_ATTN = 0x0020
+
+# TDS data types
+INTN = 0x26
+BITN = 0x68
+FLTN = 0x6D
+BIGVARBINARY = 0xA5
+NVARCHAR = 0xE7
+
+# PostgreSQL type OID -> (TDS type, byte size, struct format)
+FIXED_TYPES = {
+    16: (BITN, 1, '?'),     # bool
+    21: (INTN, 2, 'h'),     # int2
+    23: (INTN, 4, 'i'),     # int4
+    20: (INTN, 8, 'q'),     # int8
+    26: (INTN, 8, 'q'),     # oid, unsigned so widened to bigint
+    700: (FLTN, 4, 'f'),    # float4
+    701: (FLTN, 8, 'd'),    # float8
+}
+BYTEA_OID = 17
+
+# Latin1_General_CI_AS, sent with every NVARCHAR column
+COLLATION = b'\x09\x04\xd0\x00\x34'
+PLP_NULL = b'\xff' * 8
+PLP_TERMINATOR = b'\x00\x00\x00\x00'
+NULL_LENGTH = b'\x00'
+ROW_TOKEN = bytes((ROW,))
+
+_DONE = struct.Struct('<BHHQ')
+_PLP_HEADER = struct.Struct('<QI')
+
+def build_done(status=DONE_FINAL, row_count=None, cur_cmd=0, token=DONE) -> bytes:
+    if row_count is None or row_count < 0:
+        return _DONE.pack(token, status, cur_cmd, 0)
+    return _DONE.pack(token, status | DONE_COUNT, cur_cmd, row_count)
+
+def build_return_status(value=0) -> bytes:
+    return struct.pack('<Bi', RETURNSTATUS, value)
+
+def build_return_value(ordinal: int, name: str, value) -> bytes:
+    """RETURNVALUE for an integer OUTPUT parameter such as a statement handle"""
+    encoded = name.encode('utf-16le')
+    data = struct.pack('<Bi', 4, value) if value is not None else NULL_LENGTH
+    return (
+        struct.pack('<BH', RETURNVALUE, ordinal)
+        + struct.pack('<B', len(encoded) // 2) + encoded
+        + struct.pack('<BIHBB', 0x01, 0, 0x0001, INTN, 4)
+        + data
+    )
+
+def build_error(message: str, number=50000, state=1, severity=16, server=SERVER_NAME) -> bytes:
+    text = message.encode('utf-16le')
+    name = server.encode('utf-16le')
+    body = (
+        struct.pack('<iBBH', number, state, severity, len(text) // 2) + text
+        + struct.pack('<B', len(name) // 2) + name
+        + b'\x00'  # procedure name
+        + struct.pack('<i', 0)  # line number
+    )
+    return struct.pack('<BH', ERROR, len(body)) + body
+
+def _b_varchar(text: str) -> bytes:
+    encoded = text.encode('utf-16le')
+    return struct.pack('<B', len(encoded) // 2) + encoded
+
+def build_prelogin_response() -> bytes:
+    """PRELOGIN reply: our version, no encryption, no MARS"""
+    options = [
+        (PRELOGIN_VERSION, bytes(SERVER_VERSION) + b'\x00\x00'),
+        (PRELOGIN_ENCRYPTION, bytes((ENCRYPT_NOT_SUP,))),
+        (PRELOGIN_INSTOPT, b'\x00'),
+        (PRELOGIN_THREADID, b''),
+        (PRELOGIN_MARS, b'\x00'),
+    ]
+    # Option table of (token, offset, length), then the option data
+    offset = len(options) * 5 + 1
+    table, data = b'', b''
+    for token, value in options:
+        table += struct.pack('>BHH', token, offset + len(data), len(value))
+        data += value
+    return table + bytes((PRELOGIN_TERMINATOR,)) + data
+
+def build_envchange(env_type: int, new: str, old: str) -> bytes:
+    body = struct.pack('<B', env_type) + _b_varchar(new) + _b_varchar(old)
+    return struct.pack('<BH', ENVCHANGE, len(body)) + body
+
+def build_loginack(tds_version: int) -> bytes:
+    # The TDS version goes out big-endian, unlike the LOGIN7 field
+    body = struct.pack('>BI', 0x01, tds_version) + _b_varchar(SERVER_NAME) + bytes(SERVER_VERSION)
+    return struct.pack('<BH', LOGINACK, len(body)) + body
+
+def _encode_plp(data: bytes) -> bytes:
+    if not data:
+        return _PLP_HEADER.pack(0, 0)
+    return _PLP_HEADER.pack(len(data), len(data)) + data + PLP_TERMINATOR
+
+def _fixed_column(size, fmt):
+    packer = struct.Struct('<B' + fmt)
+    def encode(value):
+        if value is None:
+            return NULL_LENGTH
+        return packer.pack(size, value)
+    return encode
+
+def _text_column(value):
+    if value is None:
+        return PLP_NULL
+    return _encode_plp(str(value).encode('utf-16le'))
+
+def _binary_column(value):
+    if value is None:
+        return PLP_NULL
+    return _encode_plp(bytes(value))
+
+class RowLayout:
+    """Encoders for one result shape, compiled once per tuple of type OIDs.
+
+    Rows where every column is fixed width and non-null are packed with a
+    single struct call; anything else falls back to per-column encoders.
+    """
+
+    def __init__(self, type_codes):
+        self.type_info = []
+        self.encoders = []
+        fixed_format = '<'
+        all_fixed = True
+        for oid in type_codes:
+            if oid in FIXED_TYPES:
+                tds_type, size, fmt = FIXED_TYPES[oid]
+                self.type_info.append(struct.pack('<BB', tds_type, size))
+                self.encoders.append(_fixed_column(size, fmt))
+                fixed_format += 'B' + fmt
+            elif oid == BYTEA_OID:
+                self.type_info.append(struct.pack('<BH', BIGVARBINARY, 0xFFFF))
+                self.encoders.append(_binary_column)
+                all_fixed = False
+            else:
+                self.type_info.append(struct.pack('<BH', NVARCHAR, 0xFFFF) + COLLATION)
+                self.encoders.append(_text_column)
+                all_fixed = False
+        self.fixed_row = struct.Struct(fixed_format) if all_fixed else None
+        self.sizes = [FIXED_TYPES[oid][1] for oid in type_codes] if all_fixed else None
+
+    def encode(self, row) -> bytes:
+        if self.fixed_row is not None and None not in row:
+            values = []
+            for size, value in zip(self.sizes, row):
+                values.append(size)
+                values.append(value)
+            return ROW_TOKEN + self.fixed_row.pack(*values)
+        return ROW_TOKEN + b''.join([encode(value) for encode, value in zip(self.encoders, row)])
+
+@lru_cache(maxsize=1024)
+def compile_layout(type_codes) -> RowLayout:
+    return RowLayout(type_codes)
+
+@lru_cache(maxsize=1024)
+def build_colmetadata(columns) -> bytes:
+    layout = compile_layout(tuple(oid for _, oid in columns))
+    parts = [struct.pack('<BH', COLMETADATA, len(columns))]
+    for (name, _), type_info in zip(columns, layout.type_info):
+        encoded = name.encode('utf-16le')
+        parts.append(struct.pack('<IH', 0, 0x0001))  # user type, nullable
+        parts.append(type_info)
+        parts.append(struct.pack('<B', len(encoded) // 2) + encoded)
+    return b''.join(parts)
+
+class ResultEncoder:
+    def __init__(self, description):
+        columns = tuple((col.name, col.type_code) for col in description)
+        self.metadata = build_colmetadata(columns)
+        self.layout = compile_layout(tuple(oid for _, oid in columns))
+        self.row_count = 0
+
+    def encode_rows(self, rows) -> bytes:
+        self.row_count += len(rows)
+        encode = self.layout.encode
+        return b''.join([encode(row) for row in rows])
+
+    def done(self, status=DONE_FINAL, token=DONE) -> bytes:
+        return build_done(status, self.row_count, token=token)
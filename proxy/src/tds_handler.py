@@ -1,40 +1,671 @@
-import os
-import socket
+import re
+import asyncio
 import logging
-from connection_pool import CursorAwareConnectionPool
-from prepared_statements import PreparedStatementManager
+import psycopg
+from protocol_handler import (
+    TDSPacketReader, TDSPacketWriter, TDSProtocolError, SQL_BATCH, RPC, ATTENTION, LOGIN7, PRELOGIN,
+    DEFAULT_PACKET_SIZE, MIN_PACKET_SIZE, TDS_72, TDS_74
+)
+from tds_encoder import (
+    ResultEncoder, build_done, build_error, build_return_status, build_return_value,
+    build_prelogin_response, build_loginack, build_envchange,
+    DONE, DONEINPROC, DONEPROC, DONE_ATTN, DONE_ERROR, DONE_FINAL, DONE_MORE, ENV_DATABASE, ENV_PACKET_SIZE
+)
+from prepared_statements import PreparedStatementManager, parse_param_names
 from cursor_manager import CursorManager
+from query_handler import Translation
+from metrics import PROXY_METRICS, UNSAMPLED, start_request_timer, statement_type
+from slow_query_log import RequestTrace
+from session_backend import SessionBackend, TempTableFullError
+
+logger = logging.getLogger("tds-handler")
+
+# Plain queries whose result can be streamed
+STREAMABLE = re.compile(r"^\s*(SELECT|VALUES|TABLE)\b(?!.*\bINTO\b)", re.IGNORECASE | re.DOTALL)
+# Types of the leading parameters system procedures cannot do without
+RPC_PARAMS = {
+    "sp_prepare": (object, (str, type(None)), str),
+    "sp_prepexec": (object, (str, type(None)), str),
+    "sp_execute": (int,),
+    "sp_unprepare": (int,),
+    "sp_cursoropen": (object, str),
+    "sp_cursorfetch": (int,),
+    "sp_cursorclose": (int,),
+    "sp_executesql": (str,),
+}
+# Position of @stmt among the values of system procedures taking SQL
+RPC_STATEMENT = {"sp_prepare": 2, "sp_prepexec": 2, "sp_executesql": 0, "sp_cursoropen": 1}
+# Statements ending or starting a transaction, never pipelined
+TRANSACTION_CONTROL = frozenset(("begin", "commit", "rollback"))
+# Row limit of translated SQL, TOP n is translated to LIMIT n and may be
+# a bound parameter
+ROW_LIMIT = re.compile(r"\bLIMIT\s+(?:(\d+)|%\((\w+)\)s)", re.IGNORECASE)
+
+def row_limit(query, params):
+    """The outermost LIMIT of a statement when it is a known number"""
+    for match in ROW_LIMIT.finditer(query):
+        if query.count("(", 0, match.start()) != query.count(")", 0, match.start()):
+            # A subquery's limit says nothing about the result
+            continue
+        if match.group(1):
+            return int(match.group(1))
+        value = params.get(match.group(2)) if isinstance(params, dict) else None
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    return None
+
+class SessionMemoryError(Exception):
+    """Raised when a result would exceed the per-session memory ceiling"""
+    pass
+
+class RequestCancelled(Exception):
+    """Raised when the client cancelled the request or it timed out"""
+    pass
+
+class StreamedResult:
+    """fetchmany() over cursor.stream(): libpq hands the rows over as they
+    arrive instead of buffering the whole result first"""
+
+    def __init__(self, cursor, query, params, chunk_size):
+        self.cursor = cursor
+        self._rows = cursor.stream(query, params, size=chunk_size)
+        self._pending = []
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    async def start(self):
+        # The description arrives with the first row
+        self._pending = await self.fetchmany(1)
+
+    async def fetchmany(self, size):
+        rows, self._pending = self._pending[:size], self._pending[size:]
+        if len(rows) < size:
+            async for row in self._rows:
+                rows.append(row)
+                if len(rows) == size:
+                    break
+        return rows
+
+    async def close(self):
+        # Cancels the statement on PostgreSQL when rows are left unread
+        await self._rows.aclose()
 
 class TDSHandler:
-    def __init__(self, sock):
+    """Serves one client session: SQL batches and RPC requests.
+
+    While a request runs the socket is still read, so an attention packet
+    or a statement timeout cancels the statement on PostgreSQL instead of
+    leaving it to hold a pooled connection.
+    """
+
+    def __init__(self, sock, server):
         self.sock = sock
-        self.pool = CursorAwareConnectionPool(
-            minconn=5,
-            maxconn=20,
-            host=os.getenv("PG_HOST"),
-            database=os.getenv("PG_DB"),
-            user=os.getenv("PG_USER"),
-            password=os.getenv("PG_PASSWORD")
-        )
+        self.server = server
+        self.protocol = server.protocol
+        self.query_handler = server.query_handler
+        self.connections = server.connections
+        self.reader = TDSPacketReader(sock)
+        self.writer = TDSPacketWriter(sock)
         self.statement_mgr = PreparedStatementManager()
-        self.cursor_mgr = CursorManager()
+        self.backend = SessionBackend(self.connections, server.replicas)
+        self.cursor_mgr = CursorManager(self.backend)
+        self.timer = UNSAMPLED
+        self.slow_log = server.slow_log
+        self.trace = None
+        # Set once the current request is cancelled, with the reason
+        self.cancel_reason = None
+        self.attention = False
+        self.client_timeout = None
+        self._deadline = None
+        self._cancelling = None
+        try:
+            self.peer = "%s:%s" % sock.getpeername()[:2]
+        except (OSError, TypeError):
+            self.peer = None
 
-    def handle_client(self):
+    async def handle_client(self):
+        task = asyncio.current_task()
+        reading = None
         try:
-            while True:
-                packet = self.sock.recv(4096)
-                if not packet:
+            while not self.server.draining:
+                message = await (reading or self.reader.read_message())
+                reading = None
+                if message is None:
                     break
-                
-                # Handle TDS protocol
-                if packet[0] == 0x03:  # SQL Batch
-                    self.handle_sql_batch(packet)
-                elif packet[0] == 0x04:  # RPC
-                    self.handle_rpc(packet)
-                
+                packet_type, payload = message
+                if packet_type in (PRELOGIN, LOGIN7):
+                    await self.handle_login(packet_type, payload)
+                    continue
+                if packet_type == ATTENTION:
+                    # Nothing is running, so there is nothing left to cancel
+                    self.writer.write(build_done(DONE_ATTN))
+                    await self.writer.end_message()
+                    continue
+                if packet_type not in (SQL_BATCH, RPC):
+                    continue
+
+                self.server.busy.add(task)
+                self.timer = start_request_timer(self.reader.message_started, self.slow_log.enabled)
+                if self.slow_log.enabled:
+                    self.trace = RequestTrace()
+                try:
+                    handler = self.handle_sql_batch if packet_type == SQL_BATCH else self.handle_rpc
+                    reading = await self._run_request(handler(payload))
+                    if self.attention:
+                        # The client discards the reply up to this DONE
+                        self.writer.write(build_done(DONE_ATTN))
+                    await self.writer.end_message()
+                    self.timer.mark("send")
+                    self.timer.finish()
+                    if self.trace is not None and self.slow_log.is_slow(self.timer):
+                        self.slow_log.record(self.timer, self.trace, self.peer)
+                finally:
+                    self.server.busy.discard(task)
+                    self.timer = UNSAMPLED
+                    self.trace = None
+                    await self._end_cancel()
+
+        except Exception as e:
+            logger.error(f"Connection error: {str(e)}")
         finally:
-            self.sock.close()
+            if reading is not None:
+                reading.cancel()
+            try:
+                await self.cursor_mgr.close_all()
+            finally:
+                await self.backend.close()
+
+    async def _run_request(self, request):
+        """Run one request while reading the socket for an attention packet.
+
+        Returns the task reading the next message, if one was started, so
+        a read is never abandoned halfway through a packet.
+        """
+        work = asyncio.ensure_future(request)
+        # Scheduled after work, which parses its payload out of the read
+        # buffer before it first waits, so this read cannot overwrite it
+        reading = asyncio.ensure_future(self.reader.read_message())
+        while True:
+            await asyncio.wait((work, reading), return_when=asyncio.FIRST_COMPLETED)
+            if work.done() or not reading.done():
+                break
+            message = None if reading.exception() else reading.result()
+            if message is not None and message[0] == ATTENTION:
+                self.attention = True
+                self._cancel("attention", "Cancelled by the client")
+                reading = asyncio.ensure_future(self.reader.read_message())
+                continue
+            if message is None:
+                self._cancel("disconnect", "Client disconnected")
+            # Anything else waits until this request has been answered
+            break
+        try:
+            await work
+        except BaseException:
+            # handle_client never sees this read, so it would outlive the session
+            reading.cancel()
+            raise
+        return reading
+
+    def _cancel(self, reason, message):
+        if self.cancel_reason is not None:
+            return
+        self.cancel_reason = message
+        PROXY_METRICS['cancelled_requests'].labels(reason).inc()
+        self._cancelling = asyncio.ensure_future(self.backend.cancel())
+
+    async def _end_cancel(self):
+        self._disarm_timeout()
+        if self._cancelling is not None:
+            # A late cancel must not hit the session's next statement
+            await self._cancelling
+            self._cancelling = None
+        self.cancel_reason = None
+        self.attention = False
+
+    def _check_cancelled(self):
+        if self.cancel_reason is not None:
+            raise RequestCancelled(self.cancel_reason)
+
+    def _statement_timeout(self, label) -> float:
+        if self.client_timeout is not None:
+            return self.client_timeout
+        return self.server.statement_timeouts.get(label, self.server.statement_timeout)
+
+    def _arm_timeout(self, seconds):
+        if seconds > 0:
+            self._deadline = asyncio.get_running_loop().call_later(
+                seconds, self._cancel, "timeout", f"Statement timeout of {seconds:g}s exceeded"
+            )
+
+    def _disarm_timeout(self):
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+
+    async def handle_login(self, packet_type, payload):
+        """Answer PRELOGIN and LOGIN7. Clients are not authenticated here,
+        the proxy connects to PostgreSQL with its own credentials."""
+        if packet_type == PRELOGIN:
+            self.writer.write(build_prelogin_response())
+            await self.writer.end_message()
+            return
+        login = self.protocol.parse_login(payload)
+        if login.tds_version < TDS_72:
+            self.writer.write(build_error(
+                f"TDS version {login.tds_version:#010x} is not supported, use 7.2 or newer",
+                number=18456, severity=14
+            ))
+            self.writer.write(build_done(DONE_ERROR))
+            await self.writer.end_message()
+            raise TDSProtocolError(f"Refused login with TDS version {login.tds_version:#010x}")
+        requested = login.packet_size or DEFAULT_PACKET_SIZE
+        packet_size = max(MIN_PACKET_SIZE, min(requested, self.server.max_packet_size))
+        if login.database:
+            self.writer.write(build_envchange(ENV_DATABASE, login.database, "master"))
+        self.writer.write(build_loginack(min(login.tds_version, TDS_74)))
+        self.writer.write(build_envchange(ENV_PACKET_SIZE, str(packet_size), str(self.writer.packet_size)))
+        self.writer.write(build_done())
+        await self.writer.end_message()
+        # The new size applies from the first message after the login reply
+        self.reader.packet_size = self.writer.packet_size = packet_size
+        self.client_timeout = self.server.client_timeouts.get(login.app.lower())
+        logger.info(f"Login from {login.app or 'unknown client'} as {login.user}, packet size {packet_size}")
+
+    async def handle_sql_batch(self, payload):
+        try:
+            query = self.protocol.parse_query(SQL_BATCH, payload)
+        except TDSProtocolError as e:
+            self.writer.write(build_error(str(e)))
+            self.writer.write(build_done(DONE_ERROR))
+            return
+        self.timer.mark("parse")
+        if self.trace is not None:
+            self.trace.source.append(query)
+        if not query:
+            self.writer.write(build_done())
+            return
+        try:
+            translations = await self._run_in_executor(self.query_handler.translate_batch, query)
+            self.timer.mark("translate")
+            if len(translations) > 1:
+                self.timer.classify("batch")
+                await self.execute_batch(translations)
+            elif translations:
+                await self.execute_query(translations[0], translations[0].params)
+            else:
+                self.writer.write(build_done())
+        except (ValueError, SessionMemoryError, TempTableFullError, RequestCancelled, psycopg.Error) as e:
+            # PostgreSQL reports a cancel as a plain query_canceled error
+            message = self.cancel_reason or str(e)
+            logger.error(f"Query failed: {message}")
+            self.writer.write(build_error(message))
+            self.writer.write(build_done(DONE_ERROR))
 
-    def handle_rpc(self, packet):
+    async def handle_rpc(self, payload):
         # Handle stored procedures and prepared statements
-        pass
+        try:
+            requests = self.protocol.parse_rpc(payload)
+        except TDSProtocolError as e:
+            logger.error(f"RPC failed: {str(e)}")
+            self.writer.write(build_error(str(e)))
+            self.writer.write(build_done(DONE_ERROR, token=DONEPROC))
+            return
+        self.timer.mark("parse")
+        for request in requests:
+            try:
+                await self._dispatch_rpc(request)
+            except (ValueError, TDSProtocolError, SessionMemoryError, TempTableFullError, RequestCancelled, psycopg.Error) as e:
+                message = self.cancel_reason or str(e)
+                logger.error(f"RPC {request.name} failed: {message}")
+                self.writer.write(build_error(message))
+                self.writer.write(build_done(DONE_ERROR, token=DONEPROC))
+
+    async def _dispatch_rpc(self, request):
+        name = request.name.lower()
+        values = [param.value for param in request.params]
+        if self.trace is not None:
+            self.trace.source.append(self._describe_rpc(name, request, values))
+        self._check_rpc(request, values)
+
+        if name == "sp_prepare":
+            # @handle OUTPUT, @params, @stmt [, @options]
+            statement = await self._prepare(values[1], values[2])
+            self.writer.write(build_return_status(0))
+            self.writer.write(build_return_value(0, request.params[0].name, statement.handle))
+        elif name == "sp_prepexec":
+            # @handle OUTPUT, @params, @stmt, values...
+            statement = await self._prepare(values[1], values[2])
+            await self.execute_query(statement.translation, statement.bind(values[3:]), prepare=True, token=DONEINPROC)
+            self.writer.write(build_return_status(0))
+            self.writer.write(build_return_value(0, request.params[0].name, statement.handle))
+        elif name == "sp_execute":
+            # @handle, values...
+            statement = self.statement_mgr.get(values[0])
+            await self.execute_query(statement.translation, statement.bind(values[1:]), prepare=True, token=DONEINPROC)
+            self.writer.write(build_return_status(0))
+        elif name == "sp_unprepare":
+            self.statement_mgr.unprepare(values[0])
+            self.writer.write(build_return_status(0))
+        elif name == "sp_cursoropen":
+            await self._cursor_open(request)
+        elif name == "sp_cursorfetch":
+            # @cursor, @fetchtype, @rownum, @nrows
+            handle, fetch_type, row_number, count = (values + [None] * 4)[:4]
+            self.timer.classify("cursor")
+            description, rows = await self.cursor_mgr.fetch(
+                handle, fetch_type or 0x0002, row_number or 0, count or 1
+            )
+            self.timer.mark("execute")
+            encoder = ResultEncoder(description)
+            self.writer.write(encoder.metadata)
+            self.writer.write(encoder.encode_rows(rows))
+            self.writer.write(encoder.done(token=DONEINPROC))
+            self.timer.mark("encode")
+            self.writer.write(build_return_status(0))
+        elif name == "sp_cursorclose":
+            await self.cursor_mgr.close(values[0])
+            self.writer.write(build_return_status(0))
+        elif name == "sp_cursoroption":
+            # Options such as cursor names and text pointers do not apply
+            self.writer.write(build_return_status(0))
+        elif name == "sp_executesql":
+            # @stmt [, @params, values...]
+            names = parse_param_names(values[1] if len(values) > 1 else None)
+            translation = await self._run_in_executor(self.query_handler.translate_prepared, values[0], names)
+            self.timer.mark("translate")
+            params = dict.fromkeys(names)
+            params.update(zip(names, values[2:]))
+            await self.execute_query(translation, params, prepare=True, token=DONEINPROC)
+            self.writer.write(build_return_status(0))
+        else:
+            # Ordinary procedures were migrated to PostgreSQL functions
+            placeholders = ", ".join(["%s"] * len(values))
+            sql = f"SELECT * FROM {self._quote_name(request.name)}({placeholders})"
+            procedure = Translation(sql, None, read_only=False, tables=frozenset(), cacheable=False)
+            self.timer.classify("procedure")
+            await self.execute_query(procedure, values, prepare=True, token=DONEINPROC)
+            self.writer.write(build_return_status(0))
+        self.writer.write(build_done(token=DONEPROC))
+
+    async def _cursor_open(self, request):
+        # @cursor OUTPUT, @stmt, @scrollopt OUTPUT, @ccopt OUTPUT, @rowcount OUTPUT
+        # [, @paramdef, values...]
+        values = [param.value for param in request.params]
+        statement = values[1]
+        scroll_options = values[2] if len(values) > 2 and values[2] is not None else 0
+        if len(values) > 5 and values[5]:
+            names = parse_param_names(values[5])
+            translation = await self._run_in_executor(self.query_handler.translate_prepared, statement, names)
+            params = dict.fromkeys(names)
+            params.update(zip(names, values[6:]))
+        else:
+            translation = await self._run_in_executor(self.query_handler.translate, statement)
+            params = translation.params
+        self.timer.mark("translate")
+        self.timer.classify("cursor")
+
+        cursor = await self.cursor_mgr.open(translation.sql, params, scroll_options)
+        self.timer.mark("execute")
+        self.writer.write(ResultEncoder(cursor.description).metadata)
+        self.writer.write(build_return_status(0))
+        outputs = {0: cursor.handle, 4: -1}
+        for ordinal, param in enumerate(request.params[:5]):
+            if param.output:
+                self.writer.write(build_return_value(ordinal, param.name, outputs.get(ordinal, param.value)))
+
+    def _check_rpc(self, request, values):
+        expected = RPC_PARAMS.get(request.name.lower(), ())
+        if len(values) < len(expected):
+            raise TDSProtocolError(f"{request.name} expects at least {len(expected)} parameters, got {len(values)}")
+        for position, (value, kind) in enumerate(zip(values, expected)):
+            if not isinstance(value, kind) or isinstance(value, bool):
+                raise TDSProtocolError(f"{request.name} parameter {position + 1} has the wrong type {type(value).__name__}")
+
+    def _describe_rpc(self, name, request, values):
+        """Source of an RPC for the slow-query log. Only SQL text is logged
+        here, argument values go with the statements, which redact them."""
+        if name == "sp_execute" and values:
+            statement = self.statement_mgr.statements.get(values[0])
+            if statement is not None and statement.source:
+                return f"{request.name} {values[0]}: {statement.source}"
+        index = RPC_STATEMENT.get(name)
+        if index is not None and index < len(values) and isinstance(values[index], str):
+            return f"{request.name} {values[index]}"
+        return request.name
+
+    def _quote_name(self, name):
+        parts = [part.strip('[]"') for part in name.split(".") if part]
+        # The name comes from the client, a quote inside it must not end the identifier
+        return ".".join('"' + part.replace('"', '""') + '"' for part in parts)
+
+    async def _prepare(self, declaration, statement):
+        names = parse_param_names(declaration)
+        translation = await self._run_in_executor(self.query_handler.translate_prepared, statement, names)
+        self.timer.mark("translate")
+        return self.statement_mgr.prepare(translation, names, statement)
+
+    async def execute_batch(self, translations):
+        """Run the statements of one SQL batch, each answered with its own DONE.
+
+        Inside a transaction the client opened, runs of statements that
+        return no rows to stream go to PostgreSQL in pipeline mode, one
+        round trip per run. Outside one each statement runs on its own:
+        PostgreSQL executes a pipeline as one implicit transaction, so a
+        failure would roll back statements Sybase had already committed.
+        """
+        last = len(translations) - 1
+        index = 0
+        while index <= last:
+            if not self._pipelines(translations[index]):
+                status = DONE_MORE if index < last else DONE_FINAL
+                await self.execute_query(translations[index], translations[index].params, status=status)
+                index += 1
+                continue
+            end = index + 1
+            while end <= last and self._pipelines(translations[end]):
+                end += 1
+            await self._execute_pipeline(translations[index:end], final=end > last)
+            index = end
+
+    def _pipelines(self, translation) -> bool:
+        if not self.server.pipeline_batches or not self.backend.in_transaction:
+            return False
+        return not STREAMABLE.match(translation.sql) and statement_type(translation.sql) not in TRANSACTION_CONTROL
+
+    async def _execute_pipeline(self, translations, final):
+        self._check_cancelled()
+        self.backend.check_temp_writes(translations)
+        pg_conn = await self.backend.acquire()
+        self.timer.mark("pool_wait")
+        executed = ()
+        read_only = all(translation.read_only for translation in translations)
+        # One limit for the whole run, the most generous of its statements
+        timeouts = [self._statement_timeout(statement_type(t.sql)) for t in translations]
+        try:
+            self._arm_timeout(0 if 0 in timeouts else max(timeouts))
+            cursors = []
+            failure = None
+            try:
+                async with pg_conn.pipeline():
+                    for translation in translations:
+                        cursor = pg_conn.cursor()
+                        cursors.append(cursor)
+                        await cursor.execute(translation.sql, translation.params)
+            except psycopg.Error as e:
+                # The statements before the failing one did run in the
+                # client's transaction and are answered before the error
+                failure = e
+            # Leaving the pipeline synced it, so every result is in
+            self.timer.mark("execute")
+            if failure is not None:
+                cursors = [cursor for cursor in cursors if cursor.pgresult is not None]
+            executed = [translation.sql for translation in translations[:len(cursors)]]
+            last = len(cursors) - 1
+            for index, cursor in enumerate(cursors):
+                status = DONE_FINAL if final and index == last and failure is None else DONE_MORE
+                if cursor.description:
+                    rows, _ = await self._stream_rows(cursor, status=status)
+                else:
+                    rows = cursor.rowcount
+                    self.writer.write(build_done(status, rows))
+                await cursor.close()
+                if self.trace is not None:
+                    self.trace.add(translations[index], translations[index].params, rows)
+            if failure is not None:
+                raise failure
+            written = frozenset().union(*(t.tables for t in translations if not t.read_only))
+            if self.server.result_cache.watches(written):
+                await self._invalidate_results(pg_conn, written)
+                self.timer.mark("execute")
+        finally:
+            self._disarm_timeout()
+            await self.backend.release(pg_conn, executed, read_only)
+            self.timer.mark("pool_wait")
+
+    async def execute_query(self, translation, params, prepare=None, token=DONE, status=DONE_FINAL):
+        self._check_cancelled()
+        query = translation.sql
+        label = statement_type(query)
+        self.timer.classify(label)
+        cache = self.server.result_cache
+        cache_key = None
+        # A pinned session may be reading its own uncommitted writes
+        if self.backend.conn is None and cache.covers(translation):
+            cache_key = cache.key(query, params)
+            cached = cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                self.writer.write(cached.payload)
+                self.writer.write(build_done(status, cached.row_count, token=token))
+                self.timer.mark("encode")
+                if self.trace is not None:
+                    self.trace.add(translation, params, cached.row_count)
+                return
+        generation = cache.generation
+        capture_limit = cache.max_entry_bytes if cache_key else 0
+
+        self.backend.check_temp_writes((translation,))
+        # Cache fills read the primary, so a lagging replica cannot refill
+        # an entry a write just invalidated
+        pg_conn = await self.backend.acquire(translation.read_only and not cache_key)
+        self.timer.mark("pool_wait")
+        executed = ()
+        try:
+            self._arm_timeout(self._statement_timeout(label))
+            streaming = self._streaming(translation, params)
+            if streaming == "stream":
+                async with pg_conn.cursor() as cursor:
+                    result = StreamedResult(cursor, query, params, self.server.stream_chunk_size)
+                    try:
+                        await result.start()
+                        self.timer.mark("execute")
+                        executed = (query,)
+                        if result.description is None:
+                            # An empty stream ends without a row description
+                            await cursor.execute(f"SELECT * FROM ({query}) AS described LIMIT 0", params)
+                            self.timer.mark("execute")
+                        row_count, payload = await self._stream_rows(result, token, capture_limit, status)
+                    finally:
+                        await result.close()
+            elif streaming == "cursor":
+                # Server-side cursors only live inside a transaction
+                async with pg_conn.transaction():
+                    async with pg_conn.cursor(name="proxy_stream") as cursor:
+                        await cursor.execute(query, params)
+                        self.timer.mark("execute")
+                        row_count, payload = await self._stream_rows(cursor, token, capture_limit, status)
+                executed = (query,)
+            else:
+                async with pg_conn.cursor() as cursor:
+                    await cursor.execute(query, params, prepare=prepare)
+                    self.timer.mark("execute")
+                    executed = (query,)
+                    if cursor.description:
+                        row_count, payload = await self._stream_rows(cursor, token, capture_limit, status)
+                    else:
+                        row_count = cursor.rowcount
+                        self.writer.write(build_done(status, row_count, token=token))
+                        payload = None
+            if self.trace is not None:
+                self.trace.add(translation, params, row_count)
+            if payload is not None:
+                cache.put(cache_key, payload, row_count, translation.tables, generation)
+            if not translation.read_only and cache.watches(translation.tables):
+                await self._invalidate_results(pg_conn, translation.tables)
+                self.timer.mark("execute")
+        finally:
+            self._disarm_timeout()
+            # Stays with the session while it holds a transaction or temp tables
+            await self.backend.release(pg_conn, executed, translation.read_only)
+            self.timer.mark("pool_wait")
+
+    def _streaming(self, translation, params):
+        """How a statement's result is fetched, None for a plain cursor.
+
+        A plain cursor is one prepared round trip but libpq buffers the
+        whole result, so it is only used when the result is provably small:
+        a LIMIT within one fetch, or no table read, like procedure calls.
+        Anything else is streamed per STREAM_RESULTS: "stream", the default,
+        in the same round trip without a prepared plan, "cursor" through a
+        server-side cursor at several round trips, "off" not at all.
+        """
+        query = translation.sql
+        mode = self.server.stream_results
+        if mode == "off" or not STREAMABLE.match(query) or not translation.tables:
+            return None
+        limit = row_limit(query, params)
+        if limit is not None and limit <= self.server.fetch_size:
+            return None
+        return mode
+
+    async def _invalidate_results(self, pg_conn, tables):
+        try:
+            await self.server.result_cache.notify(pg_conn, tables)
+        except psycopg.Error as e:
+            # The write itself went through; cached entries still expire
+            logger.error(f"Result cache invalidation failed: {str(e)}")
+
+    async def _stream_rows(self, cursor, token=DONE, capture_limit=0, status=DONE_FINAL):
+        """Send a result set; returns (row_count, encoded tokens or None).
+
+        The COLMETADATA and ROW tokens are kept for the result cache when
+        they fit in capture_limit bytes.
+        """
+        server = self.server
+        timer = self.timer
+        encoder = ResultEncoder(cursor.description)
+        self.writer.write(encoder.metadata)
+        captured = [encoder.metadata] if capture_limit else None
+        fetch_size = server.fetch_size
+        while True:
+            # A cancel may land between fetches
+            self._check_cancelled()
+            rows = await cursor.fetchmany(fetch_size)
+            timer.mark("execute")
+            if not rows:
+                break
+            chunk = encoder.encode_rows(rows)
+            timer.mark("encode")
+            if len(chunk) > server.memory_limit:
+                raise SessionMemoryError(f"Result chunk exceeds session memory limit of {server.memory_limit} bytes")
+            self.writer.write(chunk)
+            if captured is not None:
+                captured.append(chunk)
+                capture_limit -= len(chunk)
+                if capture_limit < 0:
+                    captured = None
+            if self.writer.pending >= server.flush_size:
+                await self.writer.flush()
+                timer.mark("send")
+            # Shrink the next fetch so one encoded chunk stays well under the
+            # per-session ceiling even for very wide rows
+            row_bytes = max(len(chunk) // len(rows), 1)
+            fetch_size = max(1, min(server.fetch_size, server.memory_limit // 2 // row_bytes))
+        self.writer.write(encoder.done(status, token))
+        return encoder.row_count, b"".join(captured) if captured is not None else None
+
+    async def _run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.server.executor, func, *args)
@@ -0,0 +1,95 @@
+import re
+import threading
+from collections import OrderedDict
+from metrics import PROXY_METRICS
+
+# T-SQL reserved words can never be bare identifiers, so folding their case
+# cannot change what a statement translates to. Identifiers keep their case
+# because translated output quotes them.
+RESERVED_WORDS = frozenset("""
+    ADD ALL ALTER AND ANY AS ASC BEGIN BETWEEN BREAK BY CASCADE CASE CHECK CLOSE
+    COMMIT CONSTRAINT CONTINUE CREATE CROSS CURSOR DEALLOCATE DECLARE DEFAULT DELETE
+    DESC DISTINCT DROP ELSE END ESCAPE EXCEPT EXEC EXECUTE EXISTS FETCH FOR FOREIGN
+    FROM FULL FUNCTION GOTO GROUP HAVING IF IN INDEX INNER INSERT INTERSECT INTO IS
+    JOIN KEY LEFT LIKE NOT NULL OF ON OPEN OR ORDER OUTER PRIMARY PROC PROCEDURE
+    RAISERROR REFERENCES RETURN RIGHT ROLLBACK SAVE SELECT SET TABLE THEN TO TOP
+    TRAN TRANSACTION TRUNCATE UNION UNIQUE UPDATE VALUES VIEW WHEN WHERE WHILE WITH
+""".split())
+
+_TOKENS = re.compile(r"""
+    (?P<quoted>'(?:[^']|'')*'|"(?:[^"]|"")*"|\[(?:[^\]]|\]\])*\])
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<space>\s+)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+""", re.VERBOSE | re.DOTALL)
+
+def _normalize_token(match):
+    kind = match.lastgroup
+    if kind == "word":
+        word = match.group()
+        upper = word.upper()
+        return upper if upper in RESERVED_WORDS else word
+    if kind == "quoted":
+        return match.group()
+    # Comments and runs of whitespace collapse to a single separator
+    return " "
+
+def normalize_sql(query: str) -> str:
+    return _TOKENS.sub(_normalize_token, query).strip()
+
+class TranslationCache:
+    """Thread-safe LRU keyed by normalized T-SQL, bounded by entries and bytes"""
+
+    def __init__(self, name, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                PROXY_METRICS['translation_cache_misses'].labels(self.name).inc()
+                return None
+            self._entries.move_to_end(key)
+        PROXY_METRICS['translation_cache_hits'].labels(self.name).inc()
+        return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= self._cost(key, old)
+            self._entries[key] = value
+            self.size += self._cost(key, value)
+            evicted = 0
+            while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+                old_key, old_value = self._entries.popitem(last=False)
+                self.size -= self._cost(old_key, old_value)
+                evicted += 1
+            entries = len(self._entries)
+        if evicted:
+            PROXY_METRICS['translation_cache_evictions'].labels(self.name).inc(evicted)
+        PROXY_METRICS['translation_cache_entries'].labels(self.name).set(entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        PROXY_METRICS['translation_cache_entries'].labels(self.name).set(0)
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cost(self, key, value):
+        text = value if isinstance(value, str) else getattr(value, "sql", None)
+        return len(key) + (len(text) if isinstance(text, str) else 64)
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger("translation-store")
+
+SCHEMA = """
+DROP TABLE IF EXISTS meta;
+DROP TABLE IF EXISTS entries;
+CREATE TABLE IF NOT EXISTS translations (
+    version TEXT NOT NULL,
+    cache TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (version, cache, key)
+);
+CREATE INDEX IF NOT EXISTS translations_used ON translations (used);
+"""
+
+_STOP = object()
+
+class TranslationStore:
+    """SQLite file of translations shared by every worker process.
+
+    At startup a worker loads the most recently used entries into its
+    in-process caches instead of translating every statement shape again.
+    New translations are queued and written in batches by a background
+    thread, so translating never waits on disk. Entries are keyed by the
+    translation rules version given to start(), so workers of an old and
+    a new release share the file during a rolling deploy without loading
+    each other's translations. Entries of other versions unused for
+    TRANSLATION_STORE_RETENTION seconds are pruned in the background.
+    Past TRANSLATION_STORE_MAX_ENTRIES the least recently used entries
+    are deleted; entries still in a worker's cache count as used when the
+    worker stops.
+    """
+
+    def __init__(self):
+        self.path = os.getenv("TRANSLATION_STORE", "")
+        self.max_entries = int(os.getenv("TRANSLATION_STORE_MAX_ENTRIES", 100000))
+        self.flush_interval = float(os.getenv("TRANSLATION_STORE_FLUSH_INTERVAL", 1.0))
+        self.retention = float(os.getenv("TRANSLATION_STORE_RETENTION", 3600))
+        self.version = None
+        self._pruned = 0.0
+        self._db = None
+        self._pending = queue.SimpleQueue()
+        self._writer = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and self.max_entries > 0
+
+    def start(self, version) -> bool:
+        if not self.enabled or self._db:
+            return bool(self._db)
+        try:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            # WAL lets workers read while another one writes
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            if not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'translations'").fetchone():
+                # Files from before entries carried their version are dropped
+                db.executescript(SCHEMA)
+        except sqlite3.Error as e:
+            logger.error(f"Translation store {self.path} unavailable: {str(e)}")
+            return False
+        self._db = db
+        self.version = version
+        self._writer = threading.Thread(target=self._write_loop, name="translation-store", daemon=True)
+        self._writer.start()
+        return True
+
+    def load(self, cache, limit) -> list:
+        """(key, value) pairs of one cache, least recently used first"""
+        if not self._db:
+            return []
+        try:
+            rows = self._db.execute(
+                "SELECT key, value FROM (SELECT key, value, used FROM translations WHERE version = ? AND cache = ? "
+                "ORDER BY used DESC LIMIT ?) ORDER BY used",
+                (self.version, cache, limit)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Loading stored translations failed: {str(e)}")
+            return []
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def put(self, cache, key, value):
+        if self._db:
+            self._pending.put((self.version, cache, key, json.dumps(value), time.time()))
+
+    def touch(self, cache, keys):
+        if self._db:
+            now = time.time()
+            for key in keys:
+                self._pending.put((self.version, cache, key, None, now))
+
+    def stop(self):
+        if self._writer:
+            self._pending.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def _write_loop(self):
+        stopping = False
+        while not stopping:
+            batch = [self._pending.get()]
+            # Collect what else arrives within the interval into one transaction
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not _STOP:
+                try:
+                    batch.append(self._pending.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                stopping = True
+                batch.pop()
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+            except sqlite3.Error as e:
+                logger.error(f"Writing {len(batch)} translations to the store failed: {str(e)}")
+
+    def _write(self, batch):
+        with _transaction(self._db):
+            self._db.executemany(
+                "INSERT INTO translations (version, cache, key, value, used) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (version, cache, key) DO UPDATE SET value = excluded.value, used = excluded.used",
+                [item for item in batch if item[3] is not None]
+            )
+            self._db.executemany(
+                "UPDATE translations SET used = ? WHERE version = ? AND cache = ? AND key = ?",
+                [(used, version, cache, key) for version, cache, key, value, used in batch if value is None]
+            )
+            now = time.time()
+            if now - self._pruned >= self.retention / 10:
+                # Another release's workers keep their entries fresh while they run
+                self._pruned = now
+                pruned = self._db.execute(
+                    "DELETE FROM translations WHERE version != ? AND used < ?", (self.version, now - self.retention)
+                ).rowcount
+                if pruned:
+                    logger.info(f"Pruned {pruned} translations of other rules versions")
+            count = self._db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            if count > self.max_entries:
+                # Trim a tenth below the limit so this does not run on every batch
+                excess = count - self.max_entries + self.max_entries // 10
+                self._db.execute(
+                    "DELETE FROM translations WHERE rowid IN (SELECT rowid FROM translations ORDER BY used LIMIT ?)",
+                    (excess,)
+                )
+
+@contextmanager
+def _transaction(db):
+    """BEGIN IMMEDIATE ... COMMIT on an autocommit connection"""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")